@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR PACKED DATASET SHARDS
+Tests the dataset.shard format locally with generated images and captions, plus a benchmark
+against the loose-file layout
+
+This tests:
+- Packing a folder: records pair images with captions, members read back via mmap
+- Unpacking for ai-toolkit (mtimes kept, unchanged files skipped, concurrent unpacks into one folder)
+- Packed uploads and the pack_dataset / unpack_dataset jobs
+- Training configs pointing at packed datasets get a loose local folder (scratch folders pinned while in use)
+- Benchmark: reads, random access and stage-in copies, shard vs loose files
+"""
+
+import sys
+import os
+import base64
+import io
+import random
+import tempfile
+import threading
+import time
+import uuid
+import yaml
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_shard_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+
+import handler
+from handler import (
+    DatasetShard, DatasetShardWriter, pack_dataset_folder, unpack_dataset_shard, handle_upload_training_data,
+    stage_in_training_config,
+    DATASET_SHARD_FILENAME, TRAINING_DATA_ROOT
+)
+
+BENCH_FILES = int(os.environ.get("DATASET_SHARD_BENCH_FILES", 400))
+
+def jpeg_bytes(seed, size=(96, 64)):
+    image = Image.new("RGB", size, ((seed * 37) % 256, (seed * 91) % 256, 120))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def make_dataset(count=12, noise_bytes=0, root=None):
+    """Loose dataset folder as the uploader writes it: img_N.jpg + img_N.txt and the info file."""
+    folder = os.path.join(root or TRAINING_DATA_ROOT, "worker_test", f"set_{uuid.uuid4().hex[:8]}")
+    os.makedirs(folder)
+    for i in range(count):
+        with open(os.path.join(folder, f"img_{i:04d}.jpg"), "wb") as f:
+            f.write(jpeg_bytes(i) + os.urandom(noise_bytes))
+        if i % 4:  # Some images have no caption
+            with open(os.path.join(folder, f"img_{i:04d}.txt"), "w") as f:
+                f.write(f"photo of sks person, pose {i}")
+    with open(os.path.join(folder, "_training_info.txt"), "w") as f:
+        f.write("Training Name: test\nUser ID: alice\n")
+    return folder
+
+def loose_files(folder):
+    return {name: open(os.path.join(folder, name), "rb").read() for name in os.listdir(folder)
+            if name not in (DATASET_SHARD_FILENAME, "_training_info.txt")}
+
+def test_pack_and_read():
+    """Packed members match the loose files; records group image, caption and metadata."""
+    print("🧪 Testing pack and mmap reads...")
+    folder = make_dataset()
+    expected = loose_files(folder)
+    summary = pack_dataset_folder(folder)
+    assert summary["files"] == 21 and summary["records"] == 12, summary
+
+    with DatasetShard(os.path.join(folder, DATASET_SHARD_FILENAME)) as shard:
+        assert {name: shard.read(name) for name in shard.files} == expected
+        first, second = shard.records[0], shard.records[1]
+        assert first == {"key": "img_0000", "image": "img_0000.jpg", "caption": None,
+                         "metadata": {"width": 96, "height": 64}}, first
+        assert second["caption"] == "img_0001.txt"
+        assert bytes(shard.view(second["caption"])) == b"photo of sks person, pose 1"
+        assert len(shard.files["img_0001.jpg"]["sha256"]) == 64
+
+    pack_dataset_folder(folder, remove_loose=True)
+    assert sorted(os.listdir(folder)) == ["_training_info.txt", DATASET_SHARD_FILENAME]
+    try:
+        pack_dataset_folder(folder)
+        assert False, "packing an already packed folder should fail"
+    except ValueError:
+        pass
+    not_a_shard = os.path.join(folder, "_training_info.txt")
+    try:
+        DatasetShard(not_a_shard)
+        assert False, "a text file is not a shard"
+    except Exception:
+        pass
+    print(f"   ✅ {summary['records']} records, {summary['files']} members, loose files removed")
+    return True
+
+def test_unpack():
+    """Unpacking restores the files with mtimes; a second unpack only stats."""
+    print("\n🧪 Testing unpack...")
+    folder = make_dataset()
+    expected = loose_files(folder)
+    mtimes = {name: os.path.getmtime(os.path.join(folder, name)) for name in expected}
+    pack_dataset_folder(folder)
+
+    dest = tempfile.mkdtemp()
+    first = unpack_dataset_shard(os.path.join(folder, DATASET_SHARD_FILENAME), dest)
+    assert first["written"] == len(expected) and loose_files(dest) == expected
+    assert all(abs(os.path.getmtime(os.path.join(dest, name)) - mtimes[name]) < 1e-3 for name in expected)
+    again = unpack_dataset_shard(os.path.join(folder, DATASET_SHARD_FILENAME), dest)
+    assert again["written"] == 0 and again["skipped"] == len(expected)
+
+    # Workers unpacking into the same folder at once each write their own temp files
+    shared, errors = tempfile.mkdtemp(), []
+    def unpack():
+        try:
+            unpack_dataset_shard(os.path.join(folder, DATASET_SHARD_FILENAME), shared)
+        except Exception as e:
+            errors.append(e)
+    original_utime = os.utime
+    def slow_utime(path, *args, **kwargs):
+        time.sleep(0.005)  # Widen the write -> rename window so the unpacks overlap
+        return original_utime(path, *args, **kwargs)
+    threads = [threading.Thread(target=unpack) for _ in range(8)]
+    os.utime = slow_utime
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        os.utime = original_utime
+    assert errors == [] and loose_files(shared) == expected, errors
+    assert not [name for name in os.listdir(shared) if name.endswith(".tmp")]
+
+    writer = DatasetShardWriter(os.path.join(dest, "bad.shard"))
+    for bad_name in ("../escape.txt", "/etc/passwd"):
+        try:
+            writer.add(bad_name, b"x")
+            assert False, f"{bad_name} accepted"
+        except ValueError:
+            pass
+    writer.abort()
+    assert not os.path.exists(os.path.join(dest, "bad.shard.tmp"))
+    print(f"   ✅ {first['written']} files written, then {again['skipped']} skipped")
+    return True
+
+def test_packed_upload_and_jobs():
+    """upload_training_data packed=True writes one shard; pack/unpack jobs check their folders."""
+    print("\n🧪 Testing packed upload and pack/unpack jobs...")
+    files = []
+    for i in range(3):
+        files.append({"filename": f"p{i}.jpg", "content": base64.b64encode(jpeg_bytes(i, (600, 600))).decode()})
+        files.append({"filename": f"p{i}.txt", "content": base64.b64encode(b"photo of sks").decode()})
+    files.append({"filename": "../evil.txt", "content": base64.b64encode(b"x").decode()})
+    result = handle_upload_training_data({"training_name": "packed", "files": files, "packed": True,
+                                          "cleanup_existing": False, "user_id": "bob"})
+    assert result["status"] == "success" and result["packed"], result
+    folder = result["training_folder"]
+    assert sorted(os.listdir(folder)) == ["_training_info.txt", DATASET_SHARD_FILENAME]
+    assert len(result["validation_errors"]) == 1 and result["total_images"] == 3
+    assert handler.read_training_data_owner(folder) == "bob"
+    with DatasetShard(os.path.join(folder, DATASET_SHARD_FILENAME)) as shard:
+        assert shard.metadata["user_id"] == "bob"
+        assert [r["metadata"] for r in shard.records] == [{"width": 600, "height": 600}] * 3
+
+    unpacked = handler.handler({"input": {"type": "unpack_dataset", "training_folder": folder}})
+    assert unpacked["status"] == "success" and unpacked["written"] == 6, unpacked
+    assert os.path.exists(os.path.join(folder, "p2.jpg"))
+    loose = make_dataset(4)
+    packed = handler.handler({"input": {"type": "pack_dataset", "training_folder": loose, "remove_loose": True}})
+    assert packed["status"] == "success" and packed["shard"]["records"] == 4
+
+    outside = tempfile.mkdtemp()
+    assert handler.handler({"input": {"type": "pack_dataset", "training_folder": outside}})["status"] == "error"
+    assert handler.handler({"input": {"type": "unpack_dataset", "training_folder": loose,
+                                      "dest_folder": outside}})["status"] == "error"
+    assert handler.handler({"input": {"type": "unpack_dataset", "training_folder": outside}})["status"] == "error"
+    not_created = os.path.join(outside, "new", "dir")
+    assert handler.handler({"input": {"type": "unpack_dataset", "training_folder": loose,
+                                      "dest_folder": not_created}})["status"] == "error"
+    assert not os.path.exists(os.path.join(outside, "new"))  # Rejected before anything is created
+    inside = os.path.join(os.path.dirname(loose), "unpacked_copy")
+    copied = handler.handler({"input": {"type": "unpack_dataset", "training_folder": loose, "dest_folder": inside}})
+    assert copied["status"] == "success" and copied["written"] == copied["files"] > 0, copied
+    print("   ✅ Packed upload, unpack job, pack job with remove_loose")
+    return True
+
+def test_training_config_with_packed_dataset():
+    """ai-toolkit gets a loose local folder, staged or unpacked to scratch."""
+    print("\n🧪 Testing training configs with packed datasets...")
+    folder = make_dataset(6)
+    expected = loose_files(folder)
+    pack_dataset_folder(folder, remove_loose=True)
+    config = {"config": {"name": "x", "process": [{"datasets": [{"folder_path": folder}]}]}}
+    process_id = f"sh_{uuid.uuid4().hex[:6]}"
+    handler.add_process(process_id, "train", "running", config)
+    config_path = handler.write_training_config(config, process_id)
+
+    original_cache, original_unpack_dir = handler.STAGE_IN, handler.DATASET_UNPACK_DIR
+    handler.DATASET_UNPACK_DIR = tempfile.mkdtemp()
+    try:
+        for cache in (handler.StageInCache(tempfile.mkdtemp(), 10 ** 9), handler.StageInCache(tempfile.mkdtemp(), 0)):
+            handler.STAGE_IN = cache
+            run_path, staged = stage_in_training_config(process_id, config_path)
+            local = yaml.safe_load(open(run_path))["config"]["process"][0]["datasets"][0]["folder_path"]
+            assert local != folder and loose_files(local) == expected
+            assert local.startswith(cache.root if cache.max_bytes else handler.DATASET_UNPACK_DIR)
+            for path in staged:
+                handler.release_staged_path(path)
+        assert os.listdir(handler.DATASET_UNPACK_DIR) == []  # Released scratch folder removed
+
+        # Scratch folders follow the shard; one a run still reads survives a repack
+        _, running = stage_in_training_config(process_id, config_path)
+        os.utime(os.path.join(folder, DATASET_SHARD_FILENAME), (time.time() + 10, time.time() + 10))
+        _, repacked = stage_in_training_config(process_id, config_path)
+        assert running != repacked and loose_files(running[0]) == loose_files(repacked[0]) == expected
+        for path in running + repacked:
+            handler.release_staged_path(path)
+        assert os.listdir(handler.DATASET_UNPACK_DIR) == [] and not handler.SCRATCH_UNPACK_PINS
+    finally:
+        handler.STAGE_IN, handler.DATASET_UNPACK_DIR = original_cache, original_unpack_dir
+    print("   ✅ Staged copy and scratch folder both unpacked for ai-toolkit")
+    return True
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def test_benchmark_vs_loose_files():
+    """
+    Shard vs loose layout on this disk. On the network volume every open/stat is a round trip,
+    so the metadata operation count matters more than the local timings printed here.
+    """
+    print(f"\n🧪 Benchmark: {BENCH_FILES} images + captions, shard vs loose files...")
+    bench_root = tempfile.mkdtemp()  # Outside training_data: keeps the gallery listing small
+    loose = make_dataset(BENCH_FILES, noise_bytes=20000, root=bench_root)
+    packed = make_dataset(0, root=bench_root)
+    os.remove(os.path.join(packed, "_training_info.txt"))
+    for name in os.listdir(loose):
+        if name != "_training_info.txt":
+            os.link(os.path.join(loose, name), os.path.join(packed, name))
+    pack_time = timed(lambda: pack_dataset_folder(packed), repeat=1)
+    pack_dataset_folder(packed, remove_loose=True)
+    shard_path = os.path.join(packed, DATASET_SHARD_FILENAME)
+    names = sorted(loose_files(loose))
+
+    def read_loose():
+        return {name: open(os.path.join(loose, name), "rb").read() for name in sorted(os.listdir(loose))}
+
+    def read_shard():
+        with DatasetShard(shard_path) as shard:
+            return {name: shard.read(name) for name in shard.files}
+
+    assert {k: v for k, v in read_loose().items() if k != "_training_info.txt"} == read_shard()
+    sample = random.Random(0).choices(names, k=1000)
+
+    def random_loose():
+        for name in sample:
+            with open(os.path.join(loose, name), "rb") as f:
+                f.read()
+
+    def random_shard():
+        with DatasetShard(shard_path) as shard:
+            for name in sample:
+                shard.read(name)
+
+    def copy_loose():
+        dest = tempfile.mkdtemp()
+        handler.copy_tree_parallel(loose, dest, handler.stage_in_listing(loose), 8, handler.STAGE_IN_CHUNK_BYTES)
+
+    def copy_shard():
+        dest = tempfile.mkdtemp()
+        handler.copy_tree_parallel(packed, dest, handler.stage_in_listing(packed), 8, handler.STAGE_IN_CHUNK_BYTES)
+
+    rows = [
+        ("read all files", timed(read_loose), timed(read_shard)),
+        ("1000 random reads", timed(random_loose), timed(random_shard)),
+        ("stage-in copy", timed(copy_loose), timed(copy_shard)),
+    ]
+    loose_ops = len(os.listdir(loose))
+    print(f"   {'':20s} {'loose':>10s} {'shard':>10s}")
+    for label, loose_seconds, shard_seconds in rows:
+        print(f"   {label:20s} {loose_seconds * 1000:8.1f}ms {shard_seconds * 1000:8.1f}ms"
+              f"  ({loose_seconds / max(shard_seconds, 1e-9):.1f}x)")
+    print(f"   {'files to open':20s} {loose_ops:10d} {2:10d}   (shard + info file)")
+    print(f"   {'pack time':20s} {pack_time * 1000:8.1f}ms, size {handler.format_file_size(os.path.getsize(shard_path))}")
+    print("   ✅ Benchmark done")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL DATASET SHARD TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_pack_and_read,
+        test_unpack,
+        test_packed_upload_and_jobs,
+        test_training_config_with_packed_dataset,
+        test_benchmark_vs_loose_files,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
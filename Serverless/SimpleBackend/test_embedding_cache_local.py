@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR CROSS-RUN EMBEDDING CACHE
+Tests sharing ai-toolkit's latent / text embedding caches between uploads locally with fake cache files
+
+This tests:
+- Caches written by one run are copied into a new upload of the same photos
+- Keys follow image / caption content and the VAE / text encoder files
+- Partial files are not stored; LRU eviction keeps the cache within its budget
+- link_embedding_caches / harvest_embedding_caches around a training config
+"""
+
+import sys
+import os
+import json
+import struct
+import tempfile
+import time
+import uuid
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_embed_cache_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import handler
+from handler import (
+    EmbeddingCache, dataset_cache_items, model_component_id, match_cache_stem,
+    link_embedding_caches, harvest_embedding_caches, TRAINING_DATA_ROOT
+)
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def safetensors_bytes(seed, floats=64):
+    raw = json.dumps({"latent": {"dtype": "F32", "shape": [floats], "data_offsets": [0, floats * 4]}}).encode("utf-8")
+    return struct.pack("<Q", len(raw)) + raw + bytes([seed % 256]) * (floats * 4)
+
+def make_upload(images=None):
+    """Dataset folder like upload_training_data writes it (new {name}_{uuid} folder each time)."""
+    images = images or {"me_1": b"photo one", "me_2": b"photo two", "me_3": b"photo three"}
+    folder = os.path.join(TRAINING_DATA_ROOT, "worker1", f"matt_{uuid.uuid4().hex[:8]}")
+    for stem, data in images.items():
+        write_file(os.path.join(folder, f"{stem}.jpg"), data)
+        write_file(os.path.join(folder, f"{stem}.txt"), f"photo of matt, {stem}".encode("utf-8"))
+    return folder
+
+def make_model():
+    path = os.path.join(tempfile.mkdtemp(), "FLUX.1-dev")
+    for component in ("vae", "text_encoder", "text_encoder_2", "tokenizer", "transformer"):
+        write_file(os.path.join(path, component, "weights.safetensors"), os.urandom(64))
+    write_file(os.path.join(path, "model_index.json"), b"{}")
+    return path
+
+def fake_ai_toolkit_caches(folder, buckets=("bk512_aa_Zz", "bk1024_b-Q")):
+    """What ai-toolkit leaves behind: {stem}_{settings hash}.safetensors per bucket / caption."""
+    written = 0
+    for name in os.listdir(folder):
+        stem, ext = os.path.splitext(name)
+        if ext != ".jpg":
+            continue
+        for bucket in buckets:
+            path = os.path.join(folder, "_latent_cache", f"{stem}_{bucket}.safetensors")
+            if not os.path.exists(path):
+                write_file(path, safetensors_bytes(len(stem) + len(bucket)))
+                written += 1
+        path = os.path.join(folder, "_t_e_cache", f"{stem}_te9Hash.safetensors")
+        if not os.path.exists(path):
+            write_file(path, safetensors_bytes(7, 32))
+            written += 1
+    return written
+
+def cache_files(folder):
+    return sorted(os.path.relpath(os.path.join(root, name), folder) for root, _, files in os.walk(folder)
+                  for name in files if "_cache" in root)
+
+def new_cache(max_bytes=10 ** 9):
+    return EmbeddingCache(os.path.join(tempfile.mkdtemp(), "embeddings"), max_bytes)
+
+def ids_for(model_path):
+    return {kind: model_component_id({"name_or_path": model_path, "is_flux": True}, kind)
+            for kind in handler.EMBEDDING_CACHE_KINDS}
+
+def test_cross_run_hits():
+    """Caches of the first upload are copied into a second upload of the same photos."""
+    print("🧪 Testing cross-run cache hits...")
+    cache, model = new_cache(), make_model()
+    ids = ids_for(model)
+    first = make_upload()
+    items = dataset_cache_items(first)
+    assert cache.link(first, items, ids, ["latent", "text_embedding"]) == 0
+    assert fake_ai_toolkit_caches(first) == 9
+    assert cache.harvest(first, items, ids) == 9
+    assert cache.harvest(first, items, ids) == 0  # Known entries only get their LRU time refreshed
+
+    second = make_upload()
+    assert cache.link(second, dataset_cache_items(second), ids, ["latent", "text_embedding"]) == 9
+    assert cache_files(second) == cache_files(first)
+    linked = os.path.join(second, "_latent_cache", "me_1_bk512_aa_Zz.safetensors")
+    assert open(linked, "rb").read() == open(os.path.join(first, "_latent_cache", "me_1_bk512_aa_Zz.safetensors"), "rb").read()
+    assert os.stat(linked).st_nlink == 1  # Own copy: ai-toolkit may rewrite it in place
+    with open(linked, "r+b") as f:
+        f.write(b"rewritten by ai-toolkit")
+    fresh = make_upload()
+    assert cache.link(fresh, dataset_cache_items(fresh), ids, ["latent"]) == 6
+    assert open(os.path.join(fresh, "_latent_cache", "me_1_bk512_aa_Zz.safetensors"), "rb").read() == \
+        open(os.path.join(first, "_latent_cache", "me_1_bk512_aa_Zz.safetensors"), "rb").read()  # Shared blob intact
+    assert fake_ai_toolkit_caches(second) == 0  # ai-toolkit would find everything
+
+    # Changed photo: its latents miss, the unchanged caption still hits
+    third = make_upload({"me_1": b"retouched photo one", "me_2": b"photo two"})
+    assert cache.link(third, dataset_cache_items(third), ids, ["latent", "text_embedding"]) == 4
+    assert not os.path.exists(os.path.join(third, "_latent_cache", "me_1_bk512_aa_Zz.safetensors"))
+    assert os.path.exists(os.path.join(third, "_t_e_cache", "me_1_te9Hash.safetensors"))
+
+    # Latents are only copied for datasets that cache them to disk
+    fourth = make_upload()
+    assert cache.link(fourth, dataset_cache_items(fourth), ids, ["text_embedding"]) == 3
+    assert match_cache_stem("my_photo_2_ab_c.safetensors", {"my_photo", "my_photo_2"}) == ("my_photo_2", "ab_c")
+    assert match_cache_stem("other_ab.safetensors", {"my_photo"}) is None
+    print(f"   ✅ 9 files stored, 9 copied into a new upload, 4 after a photo changed")
+    return True
+
+def test_component_ids():
+    """Latents follow the VAE, text embeddings the text encoders; staged copies keep the ids."""
+    print("\n🧪 Testing VAE / text encoder ids...")
+    model = make_model()
+    ids = ids_for(model)
+    staged = os.path.join(tempfile.mkdtemp(), "FLUX.1-dev")
+    handler.copy_tree_parallel(model, staged, handler.stage_in_listing(model), 2, 1024)
+    assert ids_for(staged) == ids
+
+    write_file(os.path.join(model, "transformer", "weights.safetensors"), os.urandom(80))
+    assert ids_for(model) == ids  # Transformer does not change latents or text embeddings
+    write_file(os.path.join(model, "vae", "weights.safetensors"), os.urandom(80))
+    changed = ids_for(model)
+    assert changed["latent"] != ids["latent"] and changed["text_embedding"] == ids["text_embedding"]
+    write_file(os.path.join(model, "text_encoder_2", "weights.safetensors"), os.urandom(80))
+    assert ids_for(model)["text_embedding"] != ids["text_embedding"]
+
+    hub = {kind: model_component_id({"name_or_path": "black-forest-labs/FLUX.1-dev", "is_flux": True}, kind)
+           for kind in ("latent", "text_embedding")}
+    assert hub["latent"] != ids["latent"]
+    assert model_component_id({"name_or_path": "black-forest-labs/FLUX.1-schnell", "is_flux": True}, "latent") != hub["latent"]
+    print("   ✅ VAE change invalidates latents only, text encoder change text embeddings only")
+    return True
+
+def test_partial_files_and_eviction():
+    """Truncated cache files are not stored; the least recently used entries go first."""
+    print("\n🧪 Testing partial files and LRU eviction...")
+    model = make_model()
+    ids = ids_for(model)
+    entry_size = len(safetensors_bytes(0))
+    cache = new_cache(max_bytes=4 * entry_size)
+
+    old, new = make_upload({"old": b"old photo"}), make_upload({"new": b"new photo"})
+    fake_ai_toolkit_caches(old, buckets=("b1", "b2"))
+    partial = os.path.join(old, "_latent_cache", "old_b2.safetensors")
+    write_file(partial, safetensors_bytes(1)[:-10])
+    assert cache.harvest(old, dataset_cache_items(old), ids) == 2  # b1 + text embedding
+    time.sleep(0.01)
+    fake_ai_toolkit_caches(new, buckets=("b1", "b2", "b3"))
+    cache.harvest(new, dataset_cache_items(new), ids)
+
+    with open(cache.index_path) as f:
+        index = json.load(f)
+    assert sum(entry["size"] for entry in index.values()) <= cache.max_bytes
+    assert {entry["basename"] for entry in index.values()} == {"new.jpg"}
+    assert cache.stats()["evictions"] >= 2
+    blobs = [os.path.join(root, name) for root, _, files in os.walk(cache.root) for name in files
+             if name.endswith(".safetensors")]
+    assert len(blobs) == len(index)
+
+    # A damaged blob is dropped instead of linked
+    os.truncate(blobs[0], 10)
+    again = make_upload({"new": b"new photo"})
+    assert cache.link(again, dataset_cache_items(again), ids, ["latent", "text_embedding"]) == len(index) - 1
+    print(f"   ✅ Partial file skipped, {cache.stats()['evictions']} entries evicted, damaged blob dropped")
+    return True
+
+def test_training_config_flow():
+    """Link before launch, harvest after the run, visible in the process record and health."""
+    print("\n🧪 Testing link / harvest around a training config...")
+    model, folder = make_model(), make_upload()
+    config = {"config": {"name": "x", "process": [{
+        "model": {"name_or_path": model, "is_flux": True},
+        "datasets": [{"folder_path": folder, "caption_ext": "txt", "cache_latents_to_disk": True},
+                     {"folder_path": "/does/not/exist"}]
+    }]}}
+    process_id = f"ec_{uuid.uuid4().hex[:6]}"
+    handler.add_process(process_id, "train", "running", config)
+    config_path = handler.write_training_config(config, process_id)
+
+    original = handler.EMBEDDING_CACHE
+    handler.EMBEDDING_CACHE = new_cache()
+    try:
+        plans = link_embedding_caches(process_id, config_path)
+        assert len(plans) == 1 and handler.get_process(process_id)["embedding_cache"] == {"linked": 0}
+        fake_ai_toolkit_caches(folder)
+        harvest_embedding_caches(process_id, plans)
+
+        # Same photos, new upload folder, next run
+        config["config"]["process"][0]["datasets"][0]["folder_path"] = make_upload()
+        config_path = handler.write_training_config(config, f"{process_id}_2")
+        link_embedding_caches(process_id, config_path)
+        assert handler.get_process(process_id)["embedding_cache"] == {"linked": 9}
+        health = handler.handler({"input": {"type": "health"}})
+        assert health["embedding_cache"]["hits"] == 9 and health["embedding_cache"]["added"] == 9
+
+        assert link_embedding_caches(process_id, "/does/not/exist.yaml") == []  # Never fails training
+    finally:
+        handler.EMBEDDING_CACHE = original
+    print("   ✅ 9 stored after the first run, 9 linked before the second")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL EMBEDDING CACHE TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_cross_run_hits,
+        test_component_ids,
+        test_partial_files_and_eviction,
+        test_training_config_flow,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR FILE GALLERY
+Tests list_files / download_file locally with generated sample and dataset images
+
+This tests:
+- Sample and dataset images listed in the dashboard's list_files shape
+- since cursor paging (oldest first, no duplicates or gaps across pages)
+- Cached thumbnails keyed by content hash (identical images share one render)
+- download_file with thumbnails and workspace path checks
+"""
+
+import sys
+import os
+import base64
+import io
+import tempfile
+import time
+import uuid
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_gallery_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+
+import handler
+from handler import handle_list_files, handle_download_file, THUMBNAILS, TRAINING_OUTPUT_ROOT, TRAINING_DATA_ROOT
+
+def write_image(path, color, size=(640, 480), mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", size, color).save(path, "JPEG" if path.endswith(".jpg") else "PNG")
+    if mtime:
+        os.utime(path, (mtime, mtime))
+    return path
+
+def make_run_samples(count=5):
+    """A fake run with count sample images, one second apart."""
+    process_id = f"gal_{uuid.uuid4().hex[:8]}"
+    folder = os.path.join(TRAINING_OUTPUT_ROOT, process_id, "my_lora", "samples")
+    base = time.time() - 1000
+    paths = [write_image(os.path.join(folder, f"{i:03d}_sample.jpg"), (i * 40, 80, 120), mtime=base + i)
+             for i in range(count)]
+    return process_id, paths
+
+def test_list_files_shape():
+    """Sample and dataset images come back with the fields the dashboard renders."""
+    print("🧪 Testing list_files response shape...")
+    process_id, paths = make_run_samples(2)
+    dataset_image = write_image(os.path.join(TRAINING_DATA_ROOT, "worker1", f"set_{process_id}", "a.png"), "red")
+
+    result = handle_list_files({"refresh": True})
+    assert result["status"] == "success", result
+    by_path = {image["path"]: image for image in result["image_files"]}
+    sample = by_path[paths[0]]
+    assert sample["source"] == "samples" and sample["process_id"] == process_id
+    assert sample["type"] == "image" and sample["size"] == os.path.getsize(paths[0])
+    assert sample["size_formatted"].endswith("KB") and sample["id"].startswith("img_")
+    assert by_path[dataset_image]["source"] == "datasets" and by_path[dataset_image]["process_id"] is None
+    assert result["total_files"] == len(result["lora_files"]) + len(result["image_files"])
+
+    only_run = handle_list_files({"source": "samples", "process_id": process_id, "include_loras": False})
+    assert [image["path"] for image in only_run["image_files"]] == paths
+    assert handle_list_files({"source": "everything"})["status"] == "error"
+    print(f"   ✅ {len(result['image_files'])} images listed")
+    return True
+
+def test_since_cursor_paging():
+    """Pages follow next_cursor oldest-first; new files show up after the last cursor."""
+    print("\n🧪 Testing since cursor paging...")
+    process_id, paths = make_run_samples(5)
+    query = {"source": "samples", "process_id": process_id, "include_loras": False, "limit": 2, "refresh": True}
+
+    seen, cursor = [], None
+    while True:
+        page = handle_list_files({**query, "since": cursor})
+        seen += [image["path"] for image in page["image_files"]]
+        cursor = page["next_cursor"]
+        if not page["has_more"]:
+            break
+    assert seen == paths, seen
+
+    # Nothing new -> empty page, same cursor
+    empty = handle_list_files({**query, "since": cursor})
+    assert empty["image_files"] == [] and empty["next_cursor"] == cursor
+
+    newer = write_image(os.path.join(os.path.dirname(paths[0]), "005_sample.jpg"), "white")
+    fresh = handle_list_files({**query, "since": cursor})
+    assert [image["path"] for image in fresh["image_files"]] == [newer]
+
+    # A plain mtime works too
+    by_mtime = handle_list_files({**query, "since": os.path.getmtime(paths[2]), "limit": 10})
+    assert [image["path"] for image in by_mtime["image_files"]] == paths[3:] + [newer]
+    assert handle_list_files({**query, "since": "not-a-cursor"})["status"] == "error"
+    print(f"   ✅ {len(seen)} images over 3 pages, then 1 new image")
+    return True
+
+def test_thumbnail_cache():
+    """Thumbnails are inlined, reused, and shared by identical images."""
+    print("\n🧪 Testing cached thumbnails...")
+    process_id, paths = make_run_samples(2)
+    duplicate = os.path.join(os.path.dirname(paths[0]), "copy_of_first.jpg")
+    with open(paths[0], "rb") as src, open(duplicate, "wb") as dst:
+        dst.write(src.read())
+
+    query = {"source": "samples", "process_id": process_id, "include_loras": False,
+             "include_thumbnails": True, "thumbnail_size": 128, "refresh": True}
+    first = handle_list_files(query)
+    images = first["image_files"]
+    assert all("thumbnail" in image for image in images), images
+    thumbnail = Image.open(io.BytesIO(base64.b64decode(images[0]["thumbnail"]["data"])))
+    assert max(thumbnail.size) == 128 and thumbnail.size == (128, 96)
+
+    first_path = THUMBNAILS.lookup(paths[0], 128)
+    assert first_path and THUMBNAILS.lookup(duplicate, 128) == first_path
+    rendered_at = os.path.getmtime(first_path)
+    time.sleep(0.05)
+    handle_list_files(query)
+    assert os.path.getmtime(first_path) == rendered_at  # Served from the cache, not re-rendered
+
+    # Concurrent requests for the same image share one render
+    write_image(paths[1], "blue", mtime=time.time() + 5)
+    futures = [THUMBNAILS.request(paths[1], 256) for _ in range(3)]
+    assert futures[0] is futures[1] is futures[2]
+    assert futures[0].result(10) == THUMBNAILS.lookup(paths[1], 256)
+    assert handle_list_files({**query, "thumbnail_size": 100})["status"] == "error"
+    print(f"   ✅ {len(images)} thumbnails, duplicate shares {os.path.basename(first_path)}")
+    return True
+
+def test_download_file():
+    """download_file returns file_data for originals and thumbnails, only inside the workspace."""
+    print("\n🧪 Testing download_file...")
+    _, paths = make_run_samples(1)
+
+    original = handle_download_file({"file_path": paths[0]})
+    assert original["status"] == "success" and original["type"] == "file_data", original
+    assert original["content_type"] == "image/jpeg" and original["filename"] == "000_sample.jpg"
+    with open(paths[0], "rb") as f:
+        assert base64.b64decode(original["data"]) == f.read()
+
+    small = handle_download_file({"file_path": paths[0], "thumbnail": True, "size": 256})
+    assert small["status"] == "success" and small["content_type"].startswith("image/")
+    assert small["size"] < original["size"]
+    assert Image.open(io.BytesIO(base64.b64decode(small["data"]))).size == (256, 192)
+
+    outside = tempfile.NamedTemporaryFile(delete=False)
+    outside.close()
+    escape = os.path.join(handler.WORKSPACE_PATH, "..", os.path.relpath(outside.name, "/"))
+    assert handle_download_file({"file_path": outside.name})["status"] == "error"
+    assert handle_download_file({"file_path": escape})["status"] == "error"
+    assert handle_download_file({"file_path": paths[0] + ".missing"})["status"] == "error"
+    assert handle_download_file({})["status"] == "error"
+    print("   ✅ Original, thumbnail and path checks")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL FILE GALLERY TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_list_files_shape,
+        test_since_cursor_paging,
+        test_thumbnail_cache,
+        test_download_file,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
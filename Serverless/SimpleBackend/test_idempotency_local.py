@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR IDEMPOTENCY KEYS
+Tests that client retries of mutating jobs do not upload or train twice (no GPU needed)
+
+This tests:
+- A replayed upload_training_data / train_with_yaml returns the original response
+- A retry while the first request is still running gets an in-progress notice
+- Errors release the key; reusing a key for a different request is refused
+- Keys expire after the TTL; read-only job types ignore the key
+"""
+
+import sys
+import os
+import base64
+import io
+import tempfile
+import time
+import uuid
+import yaml
+from PIL import Image
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_idempotency_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import handler
+from handler import IDEMPOTENCY, TRAINING_DATA_ROOT
+
+def run(job_type, **job_input):
+    return handler.handler({"input": {"type": job_type, **job_input}})
+
+def upload_files():
+    buffer = io.BytesIO()
+    Image.new("RGB", (600, 600), (120, 90, 60)).save(buffer, "JPEG")
+    return [{"filename": "me.jpg", "content": base64.b64encode(buffer.getvalue()).decode()},
+            {"filename": "me.txt", "content": base64.b64encode(b"photo of sks").decode()}]
+
+def make_dataset():
+    folder = os.path.join(TRAINING_DATA_ROOT, "worker1", f"idem_{uuid.uuid4().hex[:8]}")
+    os.makedirs(folder)
+    with open(os.path.join(folder, "img_0.txt"), "w") as f:
+        f.write("photo of sks")
+    return folder
+
+def yaml_config():
+    return yaml.dump({"job": "extension", "config": {"name": f"idem_{uuid.uuid4().hex[:6]}", "process": [{
+        "type": "sd_trainer", "model": {"name_or_path": "black-forest-labs/FLUX.1-dev", "is_flux": True},
+        "datasets": [{"folder_path": "placeholder"}], "train": {"steps": 10}}]}})
+
+class NoTraining:
+    """Record launches instead of preparing / training."""
+
+    def __enter__(self):
+        self.launched = []
+        self.original = handler.prepare_training_in_background
+        handler.prepare_training_in_background = lambda process_id, *args: self.launched.append(process_id)
+        return self
+
+    def __exit__(self, *exc):
+        handler.prepare_training_in_background = self.original
+
+def test_replay_returns_original_response():
+    """Retried upload / train_with_yaml with the same key return the first response and do nothing."""
+    print("🧪 Testing replays of uploads and trainings...")
+    key = f"upload-{uuid.uuid4().hex}"
+    upload = {"training_name": "idem", "files": upload_files(), "cleanup_existing": False, "idempotency_key": key}
+    first = run("upload_training_data", **upload)
+    assert first["status"] == "success" and "idempotent_replay" not in first, first
+    worker_folders = set(os.listdir(TRAINING_DATA_ROOT))
+    again = run("upload_training_data", **upload)
+    assert again["idempotent_replay"] and again["training_folder"] == first["training_folder"]
+    assert set(os.listdir(TRAINING_DATA_ROOT)) == worker_folders  # No second upload folder
+
+    with NoTraining() as runs:
+        job = {"yaml_config": yaml_config(), "dataset_path": make_dataset(), "force": True,
+               "idempotency_key": f"train-{uuid.uuid4().hex}"}
+        trained = run("train_with_yaml", **job)
+        assert trained["status"] == "success" and runs.launched == [trained["process_id"]], trained
+        handler.update_process_status(trained["process_id"], "running")
+        replayed = run("train_with_yaml", **job)
+        assert replayed["process_id"] == trained["process_id"] and replayed["idempotent_replay"]
+        assert replayed["process_status"] == "running" and len(runs.launched) == 1  # Current status, no new thread
+    print("   ✅ One upload folder, one training thread")
+    return True
+
+def test_retry_while_in_progress():
+    """A retry that arrives before the first request finished does not start it a second time."""
+    print("\n🧪 Testing retries of requests still in progress...")
+    key = f"pack-{uuid.uuid4().hex}"
+    job = {"training_folder": make_dataset(), "idempotency_key": key}
+    assert IDEMPOTENCY.begin(key, "pack_dataset", {"type": "pack_dataset", **job}) is None  # First request running
+    retry = run("pack_dataset", **job)
+    assert retry["status"] == "in_progress" and retry["idempotency_key"] == key, retry
+    assert not os.path.exists(os.path.join(job["training_folder"], handler.DATASET_SHARD_FILENAME))
+
+    # The worker running it died: after the timeout a retry takes the key over
+    original = handler.IDEMPOTENCY_PENDING_TIMEOUT_SECONDS
+    handler.IDEMPOTENCY_PENDING_TIMEOUT_SECONDS = -1
+    try:
+        packed = run("pack_dataset", **job)
+    finally:
+        handler.IDEMPOTENCY_PENDING_TIMEOUT_SECONDS = original
+    assert packed["status"] == "success" and "idempotent_replay" not in packed, packed
+    assert run("pack_dataset", **job)["idempotent_replay"]
+    print("   ✅ In-progress notice, stale claim taken over")
+    return True
+
+def test_errors_and_conflicts():
+    """Errors can be retried; the same key with another payload or job type is refused."""
+    print("\n🧪 Testing errors and key conflicts...")
+    key = f"unpack-{uuid.uuid4().hex}"
+    folder = make_dataset()
+    failed = run("unpack_dataset", training_folder=folder, idempotency_key=key)  # Nothing packed yet
+    assert failed["status"] == "error", failed
+    run("pack_dataset", training_folder=folder, remove_loose=True)
+    unpacked = run("unpack_dataset", training_folder=folder, idempotency_key=key)
+    assert unpacked["status"] == "success" and "idempotent_replay" not in unpacked, unpacked
+
+    other_folder = run("unpack_dataset", training_folder=make_dataset(), idempotency_key=key)
+    other_type = run("pack_dataset", training_folder=folder, idempotency_key=key)
+    for conflict in (other_folder, other_type):
+        assert conflict["status"] == "error" and "already used" in conflict["error"], conflict
+    print("   ✅ Failed request re-run, conflicting reuse refused")
+    return True
+
+def test_ttl_and_read_only_types():
+    """Keys expire after the TTL; job types without side effects never store responses."""
+    print("\n🧪 Testing key expiry and read-only types...")
+    key = f"ttl-{uuid.uuid4().hex}"
+    job = {"training_folder": make_dataset(), "idempotency_key": key}
+    assert run("pack_dataset", **job)["status"] == "success"
+    assert run("pack_dataset", **job)["idempotent_replay"]
+
+    original = handler.IDEMPOTENCY_TTL_SECONDS
+    handler.IDEMPOTENCY_TTL_SECONDS = 0
+    try:
+        time.sleep(0.01)
+        expired = run("pack_dataset", **job)
+    finally:
+        handler.IDEMPOTENCY_TTL_SECONDS = original
+    assert "idempotent_replay" not in expired and expired["status"] == "success", expired
+    with IDEMPOTENCY.table as entries:
+        assert list(entries) == [key]  # Everything older was purged
+
+    read_key = f"read-{uuid.uuid4().hex}"
+    assert "idempotent_replay" not in run("processes", idempotency_key=read_key)
+    assert "idempotent_replay" not in run("processes", idempotency_key=read_key)
+    print("   ✅ Expired key re-run, read-only jobs untouched")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL IDEMPOTENCY TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_replay_returns_original_response,
+        test_retry_while_in_progress,
+        test_errors_and_conflicts,
+        test_ttl_and_read_only_types,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR CPU LORA TOOLS
+Tests LoRA post-processing locally with small synthetic tensors (NumPy only, no GPU)
+
+This tests:
+- Batched SVD rank reduction to a target rank or energy threshold (compress_lora)
+- kohya (lora_down/up + alpha), PEFT (lora_A/B) and conv LoRA layouts
+- fp16 / bf16 conversion, size reduction and reconstruction error reporting
+- Weighted merging of several adapters (merge_loras), exact concat and SVD-recompressed
+"""
+
+import sys
+import os
+import tempfile
+
+# Keep outputs and indexes out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_tools_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import handler
+from handler import (
+    load_lora_arrays, save_lora_arrays, find_lora_pairs, lora_scale, compress_lora_arrays,
+    handle_compress_lora, handle_list_trained_models, read_safetensors_header, merge_lora_arrays, handle_merge_loras
+)
+
+RNG = np.random.default_rng(0)
+
+def make_pair(out_dim, in_dim, rank, true_rank, noise=0.0):
+    """up [out, rank] / down [rank, in] whose product only has true_rank significant directions."""
+    basis_up = RNG.standard_normal((out_dim, true_rank)).astype(np.float32)
+    basis_down = RNG.standard_normal((true_rank, in_dim)).astype(np.float32)
+    mix = RNG.standard_normal((true_rank, rank)).astype(np.float32)
+    up = basis_up @ mix / np.sqrt(rank)
+    down = np.linalg.pinv(mix) @ basis_down
+    up += noise * RNG.standard_normal(up.shape).astype(np.float32)
+    return up.astype(np.float32), down.astype(np.float32)
+
+def make_lora(layout="kohya", modules=4, rank=16, true_rank=4, noise=0.0):
+    arrays = {}
+    for i in range(modules):
+        up, down = make_pair(48, 40, rank, true_rank, noise)
+        if layout == "kohya":
+            arrays[f"lora_unet_block_{i}_to_q.lora_up.weight"] = up
+            arrays[f"lora_unet_block_{i}_to_q.lora_down.weight"] = down
+            arrays[f"lora_unet_block_{i}_to_q.alpha"] = np.array(8.0, dtype=np.float32)
+        else:
+            arrays[f"transformer.blocks.{i}.attn.to_q.lora_B.weight"] = up
+            arrays[f"transformer.blocks.{i}.attn.to_q.lora_A.weight"] = down
+    return arrays
+
+def delta_weights(arrays):
+    """Effective delta weight of every module (scale * up @ down)."""
+    deltas = {}
+    for module, pair in find_lora_pairs(arrays).items():
+        down, up = arrays[pair[0]], arrays[pair[1]]
+        up2d = up.reshape(up.shape[0], up.shape[1]).astype(np.float64)
+        down2d = down.reshape(down.shape[0], -1).astype(np.float64)
+        deltas[module] = lora_scale(arrays, pair) * up2d @ down2d
+    return deltas
+
+def relative_error(a, b):
+    return float(np.linalg.norm(a - b) / np.linalg.norm(a))
+
+def write_model(folder, name, arrays, dtype=None):
+    path = os.path.join(handler.TRAINING_OUTPUT_ROOT, folder, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_lora_arrays(path, arrays, {"name": name}, dtype)
+    return path
+
+def test_energy_threshold_recovers_rank():
+    """An energy threshold finds the true rank and keeps the delta weights (alpha folded in)."""
+    print("🧪 Testing energy-threshold rank reduction...")
+    for layout in ("kohya", "peft"):
+        arrays = make_lora(layout)
+        compressed, stats = compress_lora_arrays(arrays, energy=0.9999)
+        assert stats["ranks_before"] == {16: 4} and stats["ranks_after"] == {4: 4}, stats
+        assert stats["reconstruction_error_max"] < 1e-3
+        before, after = delta_weights(arrays), delta_weights(compressed)
+        for module in before:
+            assert relative_error(before[module], after[module]) < 1e-4, (layout, module)
+    print("   ✅ rank 16 -> 4 with unchanged delta weights (kohya and PEFT)")
+    return True
+
+def test_target_rank_error_reported():
+    """Truncating below the true rank reports the real reconstruction error."""
+    print("\n🧪 Testing fixed target rank and error report...")
+    arrays = make_lora("kohya", true_rank=8)
+    compressed, stats = compress_lora_arrays(arrays, rank=3)
+    assert stats["ranks_after"] == {3: 4}
+    before, after = delta_weights(arrays), delta_weights(compressed)
+    measured = [relative_error(before[m], after[m]) for m in before]
+    assert abs(max(measured) - stats["reconstruction_error_max"]) < 1e-3, (measured, stats)
+    assert 0 < stats["energy_retained_min"] < 1
+    print(f"   ✅ reported error {stats['reconstruction_error_max']:.4f} matches measured {max(measured):.4f}")
+    return True
+
+def test_conv_lora_layout():
+    """Conv LoRA (down [r, in, kh, kw], up [out, r, 1, 1]) keeps its layout."""
+    print("\n🧪 Testing conv LoRA layout...")
+    up, down = make_pair(24, 8 * 9, 8, 2)
+    arrays = {
+        "lora_unet_conv.lora_up.weight": up.reshape(24, 8, 1, 1),
+        "lora_unet_conv.lora_down.weight": down.reshape(8, 8, 3, 3),
+        "lora_unet_conv.alpha": np.array(8.0, dtype=np.float32)
+    }
+    compressed, stats = compress_lora_arrays(arrays, energy=0.9999)
+    assert compressed["lora_unet_conv.lora_up.weight"].shape == (24, 2, 1, 1)
+    assert compressed["lora_unet_conv.lora_down.weight"].shape == (2, 8, 3, 3)
+    assert relative_error(delta_weights(arrays)["lora_unet_conv"], delta_weights(compressed)["lora_unet_conv"]) < 1e-4
+    print("   ✅ conv factors reshaped to rank 2")
+    return True
+
+def test_compress_lora_job_bf16():
+    """compress_lora writes a smaller bf16 file into the output tree and reports the savings."""
+    print("\n🧪 Testing compress_lora job type with bf16 output...")
+    arrays = make_lora("peft", modules=6, rank=16, true_rank=4)
+    source = write_model("compress01", "person_lora.safetensors", arrays)
+
+    result = handle_compress_lora({"model_path": source, "energy": 0.9999, "dtype": "bf16"})
+    assert result["status"] == "success", result
+    assert result["filename"] == "person_lora_e0.9999_bf16.safetensors"
+    assert result["compressed_size_bytes"] < result["original_size_bytes"] / 6
+    assert result["compression"]["ranks_after"] == {4: 6}
+
+    header = read_safetensors_header(result["output_path"])
+    assert {t["dtype"] for n, t in header.items() if not n.startswith("__")} == {"BF16"}
+    assert header["__metadata__"]["compressed_from"] == "person_lora.safetensors"
+    reloaded, _, _ = load_lora_arrays(result["output_path"])
+    before, after = delta_weights(arrays), delta_weights(reloaded)
+    assert max(relative_error(before[m], after[m]) for m in before) < 1e-2, "bf16 rounding only"
+
+    listed = handle_list_trained_models({"folder": "compress01", "kind": "compressed"})["models"]
+    assert [m["filename"] for m in listed] == [result["filename"]]
+
+    dtype_only = handle_compress_lora({"model_path": source, "dtype": "fp16"})
+    assert dtype_only["status"] == "success" and dtype_only["compression"] is None
+    assert abs(dtype_only["size_reduction_pct"] - 50) < 5
+    print(f"   ✅ {result['original_size_bytes']} -> {result['compressed_size_bytes']} bytes "
+          f"({result['size_reduction_pct']}% smaller)")
+    return True
+
+def test_compress_lora_errors():
+    """Bad options and non-LoRA files are rejected."""
+    print("\n🧪 Testing compress_lora errors...")
+    source = write_model("compress02", "plain.safetensors", {"weight": np.ones((4, 4), dtype=np.float32)})
+    assert handle_compress_lora({"model_path": source})["status"] == "error"
+    assert handle_compress_lora({"model_path": source, "dtype": "int4"})["status"] == "error"
+    assert handle_compress_lora({"model_path": source, "rank": 0})["status"] == "error"
+    assert "positive integer" in handle_compress_lora({"model_path": source, "rank": True})["error"]
+    assert handle_compress_lora({"model_path": source, "rank": 4})["status"] == "error"
+    assert handle_compress_lora({"model_path": source, "dtype": "fp16", "output_name": "plain"})["status"] == "error"
+    print("   ✅ Invalid requests rejected")
+    return True
+
+def make_person_and_style():
+    """Two kohya LoRAs sharing modules 2-3; person has modules 0-3, style has 2-5."""
+    person, style = {}, {}
+    for target, modules, rank in ((person, range(0, 4), 8), (style, range(2, 6), 4)):
+        for i in modules:
+            up, down = make_pair(48, 40, rank, rank)
+            target[f"lora_unet_block_{i}_to_q.lora_up.weight"] = up
+            target[f"lora_unet_block_{i}_to_q.lora_down.weight"] = down
+            target[f"lora_unet_block_{i}_to_q.alpha"] = np.array(rank / 2, dtype=np.float32)
+    return person, style
+
+def test_merge_concat_exact():
+    """Concatenated factors reproduce the weighted sum of the delta weights exactly."""
+    print("\n🧪 Testing exact concat merge...")
+    person, style = make_person_and_style()
+    merged, stats = merge_lora_arrays([(person, 1.0), (style, 0.5)])
+    assert stats["modules"] == 6 and stats["modules_shared"] == 2
+    assert stats["ranks_after"] == {8: 2, 12: 2, 4: 2}
+
+    person_delta, style_delta, merged_delta = delta_weights(person), delta_weights(style), delta_weights(merged)
+    for module, delta in merged_delta.items():
+        expected = person_delta.get(module, 0) + 0.5 * style_delta.get(module, 0)
+        assert relative_error(expected, delta) < 1e-5, module
+    print("   ✅ merged delta == person + 0.5 * style for all 6 modules")
+    return True
+
+def test_merge_loras_job():
+    """merge_loras writes one adapter into the output tree; svd keeps the largest source rank."""
+    print("\n🧪 Testing merge_loras job type...")
+    person, style = make_person_and_style()
+    person_path = write_model("merge01", "person.safetensors", person)
+    style_path = write_model("merge01", "style.safetensors", style)
+    request = {"models": [{"model_path": person_path, "weight": 1.0}, {"model_path": style_path, "weight": 0.7}]}
+
+    exact = handle_merge_loras({**request, "output_name": "person_style"})
+    assert exact["status"] == "success", exact
+    assert exact["output_path"].endswith(os.path.join("merged", "person_style.safetensors"))
+    reloaded, metadata, _ = load_lora_arrays(exact["output_path"])
+    assert metadata["merge_method"] == "concat" and "person.safetensors" in metadata["merged_from"]
+    expected = delta_weights(person)["lora_unet_block_2_to_q"] + 0.7 * delta_weights(style)["lora_unet_block_2_to_q"]
+    assert relative_error(expected, delta_weights(reloaded)["lora_unet_block_2_to_q"]) < 1e-5
+
+    svd = handle_merge_loras({**request, "method": "svd", "output_name": "person_style_svd", "dtype": "fp16"})
+    assert svd["status"] == "success", svd
+    assert set(svd["merge"]["ranks_after"]) <= {4, 8} and svd["size_bytes"] < exact["size_bytes"]
+    assert svd["merge"]["compression"]["reconstruction_error_max"] < 0.5
+
+    listed = {m["filename"] for m in handle_list_trained_models({"folder": "merged", "kind": "merged"})["models"]}
+    assert {"person_style.safetensors", "person_style_svd.safetensors"} <= listed
+
+    again = handle_merge_loras({**request, "output_name": "person_style"})
+    assert again["status"] == "error", "existing merge must not be overwritten silently"
+    assert handle_merge_loras({"models": request["models"][:1]})["status"] == "error"
+    assert "positive integer" in handle_merge_loras({**request, "method": "svd", "rank": True})["error"]
+    mismatched = write_model("merge01", "other.safetensors", {
+        "lora_unet_block_2_to_q.lora_up.weight": np.ones((32, 4), dtype=np.float32),
+        "lora_unet_block_2_to_q.lora_down.weight": np.ones((4, 40), dtype=np.float32)
+    })
+    bad = handle_merge_loras({"models": [{"model_path": person_path}, {"model_path": mismatched}]})
+    assert bad["status"] == "error" and "incompatible" in bad["error"]
+    print(f"   ✅ concat {exact['size_bytes']} bytes, svd+fp16 {svd['size_bytes']} bytes")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL LORA TOOLS TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_energy_threshold_recovers_rank,
+        test_target_rank_error_reported,
+        test_conv_lora_layout,
+        test_compress_lora_job_bf16,
+        test_compress_lora_errors,
+        test_merge_concat_exact,
+        test_merge_loras_job,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR MODEL ARTIFACTS
+Tests per-process outputs and model artifact handling locally with fake model files
+
+This tests:
+- Per-process output directory injected into training_folder
+- Artifact manifest (checkpoints, final weights, samples, sizes, hashes)
+- process_status / download_model resolving artifacts through the manifest
+- Incremental model index (completion hook, mtime-validated directory cache, paging)
+- Ranged chunk downloads and the parallel, resumable tester client
+- Background sha256 cache keyed by (inode, size, mtime), batched saves, and if_none_match downloads
+- Safetensors header introspection in list_models (rank, modules, params, metadata)
+- bulk_download tar export served in chunks by retrieval token
+"""
+
+import sys
+import os
+import base64
+import hashlib
+import json
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_artifacts_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# The chunked download client lives with the endpoint testers
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Testing"))
+
+import handler
+from handler import (
+    add_process, update_process_fields, get_process, assign_process_output_dir,
+    complete_training_process, handle_process_status, handle_download_model,
+    PROCESS_MANIFESTS, PROCESS_LOCK, ModelIndex, MODEL_INDEX, handle_list_trained_models, FILE_HASHES,
+    handle_bulk_download, BULK_EXPORT_LAYOUTS
+)
+from chunked_download_client import ChunkedModelDownloader, ChunkedDownloadError
+
+def make_config(name="my_lora", steps=1000):
+    return {
+        "job": "extension",
+        "config": {
+            "name": name,
+            "process": [{
+                "type": "sd_trainer",
+                "training_folder": "output",
+                "network": {"type": "lora", "linear": 16},
+                "train": {"steps": steps}
+            }]
+        }
+    }
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def write_fake_safetensors(path, tensors, metadata=None, truncate=0):
+    """Write a valid .safetensors file with zeroed data: tensors = {name: (dtype, shape)}."""
+    dtype_bytes = {"F32": 4, "F16": 2, "BF16": 2}
+    header, offset = {}, 0
+    for name, (dtype, shape) in tensors.items():
+        size = dtype_bytes[dtype]
+        for dim in shape:
+            size *= dim
+        header[name] = {"dtype": dtype, "shape": list(shape), "data_offsets": [offset, offset + size]}
+        offset += size
+    if metadata:
+        header["__metadata__"] = metadata
+    raw = json.dumps(header).encode("utf-8")
+    write_file(path, struct.pack("<Q", len(raw)) + raw + b"\0" * (offset - truncate))
+
+def fake_finished_run(process_id, name="my_lora"):
+    """Register a process and create the files ai-toolkit would leave in its output folder."""
+    config = make_config(name)
+    output_dir = assign_process_output_dir(config, process_id)
+    add_process(process_id, "train_yaml", "running", config)
+    update_process_fields(process_id, output_dir=output_dir)
+
+    run_folder = os.path.join(output_dir, name)
+    write_file(os.path.join(run_folder, f"{name}_000000250.safetensors"), b"ckpt-250")
+    write_file(os.path.join(run_folder, f"{name}_000000500.safetensors"), b"ckpt-500")
+    write_file(os.path.join(run_folder, f"{name}.safetensors"), b"final-weights")
+    write_file(os.path.join(run_folder, "samples", "1_000000250_0.jpg"), b"sample")
+    write_file(os.path.join(run_folder, "optimizer.pt"), b"optimizer")
+    return output_dir, run_folder
+
+def test_process_output_dir():
+    """Each process gets training_folder = output root / process id."""
+    print("🧪 Testing per-process output directory...")
+    config = make_config()
+    output_dir = assign_process_output_dir(config, "abc12345")
+    assert output_dir.endswith(os.path.join("output", "abc12345"))
+    assert config["config"]["process"][0]["training_folder"] == output_dir
+    print(f"   ✅ training_folder -> {output_dir}")
+    return True
+
+def test_artifact_manifest():
+    """Completion writes a manifest with checkpoints, final weights, samples and hashes."""
+    print("\n🧪 Testing artifact manifest...")
+    output_dir, run_folder = fake_finished_run("man01")
+    complete_training_process("man01")
+
+    process = get_process("man01")
+    assert process["status"] == "completed" and process["output_path"] == output_dir
+    assert os.path.exists(process["manifest_path"])
+
+    status = handle_process_status({"process_id": "man01"})
+    manifest = status["artifacts"]
+    assert [c["step"] for c in manifest["checkpoints"]] == [250, 500]
+    assert manifest["final"]["sha256"] == hashlib.sha256(b"final-weights").hexdigest()
+    assert manifest["final"]["size_bytes"] == len(b"final-weights")
+    assert [s["relative_path"] for s in manifest["samples"]] == [os.path.join("samples", "1_000000250_0.jpg")]
+    assert all("optimizer" not in c["filename"] for c in manifest["checkpoints"])
+    print(f"   ✅ Manifest at {process['manifest_path']}")
+    return True
+
+def test_download_via_manifest():
+    """download_model resolves final/step/filename through the manifest, also after a restart."""
+    print("\n🧪 Testing download through manifest...")
+    fake_finished_run("man02")
+    complete_training_process("man02")
+    with PROCESS_LOCK:
+        PROCESS_MANIFESTS.clear()  # Worker restart: manifest comes back from disk
+
+    final = handle_download_model({"process_id": "man02"})
+    assert final["status"] == "success", final
+    assert base64.b64decode(final["content"]) == b"final-weights"
+
+    step = handle_download_model({"process_id": "man02", "artifact": 250})
+    assert base64.b64decode(step["content"]) == b"ckpt-250"
+
+    by_name = handle_download_model({"process_id": "man02", "filename": "my_lora_000000500.safetensors"})
+    assert base64.b64decode(by_name["content"]) == b"ckpt-500"
+
+    missing = handle_download_model({"process_id": "man02", "artifact": 999})
+    assert missing["status"] == "error"
+    print("   ✅ final, step 250 and filename lookups OK")
+    return True
+
+def test_model_index_directory_cache():
+    """Unchanged directories are not re-listed, new and deleted files are picked up."""
+    print("\n🧪 Testing model index directory cache...")
+    root = tempfile.mkdtemp()
+    for process_id in ("p1", "p2"):
+        write_file(os.path.join(root, process_id, "lora", "lora.safetensors"), b"x" * 10)
+        for i in range(50):
+            write_file(os.path.join(root, process_id, "lora", "samples", f"{i}.jpg"), b"img")
+    index = ModelIndex(root, os.path.join(tempfile.mkdtemp(), "index.json"))
+
+    assert index.validate(force=True)
+    assert index.query()["total_count"] == 2
+    assert not any("samples" in d for d in index.dir_cache), "sample folders must be skipped"
+    assert not index.validate(force=True), "nothing changed, nothing re-listed"
+
+    time.sleep(0.01)
+    new_model = os.path.join(root, "p3", "lora", "lora_000000250.safetensors")
+    write_file(new_model, b"y" * 20)
+    os.remove(os.path.join(root, "p1", "lora", "lora.safetensors"))
+    assert index.validate(force=True)
+    paths = {m["full_path"] for m in index.query()["models"]}
+    assert new_model in paths and len(paths) == 2
+
+    # Persistent: a fresh worker starts from the saved index
+    reloaded = ModelIndex(root, index.index_path)
+    reloaded.load()
+    assert set(reloaded.entries) == paths
+    print("   ✅ Directory cache validated by mtime")
+    return True
+
+def test_list_models_paging():
+    """list_models sorts, filters and paginates the index; completion registers models."""
+    print("\n🧪 Testing list_models on the index...")
+    fake_finished_run("idx01", name="alpha_lora")
+    complete_training_process("idx01")
+    indexed = MODEL_INDEX.query(folder="idx01")["models"]
+    assert {m.get("kind") for m in indexed} == {"final", "checkpoint"}
+    assert all(m.get("sha256") for m in indexed)
+
+    everything = handle_list_trained_models({"refresh": True})
+    assert everything["status"] == "success", everything
+    total = everything["total_count"]
+    assert total >= 3
+
+    page = handle_list_trained_models({"sort_by": "name", "order": "asc", "offset": 1, "limit": 2})
+    names = [m["filename"] for m in handle_list_trained_models({"sort_by": "name", "order": "asc"})["models"]]
+    assert [m["filename"] for m in page["models"]] == names[1:3]
+    assert page["has_more"] == (total > 3)
+
+    finals = handle_list_trained_models({"kind": "final", "search": "alpha"})
+    assert [m["filename"] for m in finals["models"]] == ["alpha_lora.safetensors"]
+
+    by_name = handle_download_model({"filename": "alpha_lora_000000250.safetensors"})
+    assert by_name["status"] == "success" and base64.b64decode(by_name["content"]) == b"ckpt-250"
+
+    bad = handle_list_trained_models({"sort_by": "color"})
+    assert bad["status"] == "error"
+    print(f"   ✅ {total} models, paging/filter/sort OK")
+    return True
+
+def test_chunked_download():
+    """Chunks carry their own hash; the client fetches in parallel, retries and resumes."""
+    print("\n🧪 Testing chunked download...")
+    payload = os.urandom(1024 * 1024 + 123)
+    model_path = os.path.join(handler.TRAINING_OUTPUT_ROOT, "chunk01", "big_lora.safetensors")
+    write_file(model_path, payload)
+
+    chunk = handle_download_model({"model_path": model_path, "offset": 1000, "length": 4096})
+    assert chunk["status"] == "success", chunk
+    assert base64.b64decode(chunk["content"]) == payload[1000:5096]
+    assert chunk["chunk_sha256"] == hashlib.sha256(payload[1000:5096]).hexdigest()
+    assert chunk["next_offset"] == 5096 and chunk["version"]
+    # The whole-file hash is never computed in the request; it follows once the background hasher ran
+    assert chunk["sha256"] is None and chunk["sha256_pending"]
+    assert FILE_HASHES.wait_idle()
+    chunk = handle_download_model({"model_path": model_path, "offset": 1000, "length": 4096})
+    assert chunk["sha256"] == hashlib.sha256(payload).hexdigest() and not chunk["sha256_pending"]
+    last = handle_download_model({"model_path": model_path, "offset": len(payload) - 10, "length": 4096})
+    assert last["length"] == 10 and last["eof"] and last["next_offset"] is None
+    assert handle_download_model({"model_path": model_path, "offset": len(payload) + 1})["status"] == "error"
+
+    # Chunks are opt-in: without offset/length the whole file still comes back inline, whatever its size
+    original = handler.DOWNLOAD_INLINE_MAX_BYTES
+    handler.DOWNLOAD_INLINE_MAX_BYTES = 1024
+    try:
+        whole = handle_download_model({"model_path": model_path})
+    finally:
+        handler.DOWNLOAD_INLINE_MAX_BYTES = original
+    assert whole["status"] == "success" and base64.b64decode(whole["content"]) == payload
+
+    calls, failures = [], {"flaky": {4096 * 8}, "fatal": set()}
+    def request_fn(job_type, input_data):
+        offset = input_data["offset"]
+        calls.append(offset)
+        if input_data["length"] and offset in failures["flaky"]:
+            failures["flaky"].discard(offset)
+            raise ConnectionError("worker dropped the response")
+        if input_data["length"] and offset in failures["fatal"]:
+            raise ConnectionError("endpoint gone")
+        return handle_download_model(input_data)
+
+    chunk_count = -(-len(payload) // 65536)
+    dest = os.path.join(tempfile.mkdtemp(), "big_lora.safetensors")
+    failures["fatal"] = {65536 * 10, 65536 * 11}
+    client = ChunkedModelDownloader(request_fn, chunk_size=65536, workers=1, max_retries=0, retry_delay=0)
+    try:
+        client.download({"model_path": model_path}, dest)
+        assert False, "download should have failed"
+    except ChunkedDownloadError:
+        pass
+    assert os.path.exists(dest + ".part.json") and not os.path.exists(dest)
+
+    failures["fatal"] = set()
+    client = ChunkedModelDownloader(request_fn, chunk_size=65536, workers=4, retry_delay=0)
+    result = client.download({"model_path": model_path}, dest)
+    with open(dest, "rb") as f:
+        assert f.read() == payload
+    assert result["chunks_resumed"] > 0 and result["chunks_resumed"] + result["chunks_fetched"] == chunk_count
+    assert not os.path.exists(dest + ".part") and not os.path.exists(dest + ".part.json")
+    print(f"   ✅ {chunk_count} chunks, {result['chunks_resumed']} resumed after failure")
+    return True
+
+def test_conditional_download():
+    """Hashes are computed once in the background; if_none_match short-circuits unchanged files."""
+    print("\n🧪 Testing hash cache and conditional download...")
+    model_path = os.path.join(handler.TRAINING_OUTPUT_ROOT, "etag01", "etag_lora.safetensors")
+    write_file(model_path, b"a" * 4096)
+    original_hash = hashlib.sha256(b"a" * 4096).hexdigest()
+
+    # Discovered by the index scan -> hashed in the background -> exposed by list_models
+    handle_list_trained_models({"refresh": True})
+    assert FILE_HASHES.wait_idle()
+    listed = handle_list_trained_models({"folder": "etag01"})["models"]
+    assert listed[0]["sha256"] == original_hash
+
+    hashed = []
+    original_sha256_file = handler.sha256_file
+    in_request = []  # Hashes computed on the calling thread instead of the background hasher
+    def counting_sha256_file(path):
+        hashed.append(path)
+        if threading.current_thread() is threading.main_thread():
+            in_request.append(path)
+        return original_sha256_file(path)
+    handler.sha256_file = counting_sha256_file
+    try:
+        same = handle_download_model({"model_path": model_path, "if_none_match": original_hash})
+        assert same["status"] == "not_modified" and "content" not in same
+        assert hashed == [], "cached hash must not be recomputed"
+
+        # Same size, new content and mtime -> new key, full download; the new hash follows in the background
+        write_file(model_path, b"b" * 4096)
+        os.utime(model_path, ns=(time.time_ns(), time.time_ns() + 1000))
+        changed = handle_download_model({"model_path": model_path, "if_none_match": original_hash})
+        assert changed["status"] == "success" and base64.b64decode(changed["content"]) == b"b" * 4096
+        assert changed["sha256_pending"] == (changed["sha256"] is None)
+        assert FILE_HASHES.wait_idle() and hashed == [model_path] and in_request == []
+        again = handle_download_model({"model_path": model_path})
+        assert again["sha256"] == hashlib.sha256(b"b" * 4096).hexdigest()
+
+        # Atomically replaced file keeps size and mtime but gets a new inode
+        st = os.stat(model_path)
+        replacement = model_path + ".new"
+        write_file(replacement, b"c" * 4096)
+        os.utime(replacement, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(replacement, model_path)
+        assert FILE_HASHES.lookup(model_path) is None
+    finally:
+        handler.sha256_file = original_sha256_file
+    print("   ✅ not_modified served from cache, changes and replacements rehashed")
+    return True
+
+def test_hash_cache_batched_saves():
+    """Many new hashes cost one write of the cache file; entries of deleted files are dropped."""
+    print("\n🧪 Testing batched hash cache saves...")
+    folder = tempfile.mkdtemp()
+    cache = handler.FileHashCache(os.path.join(folder, "indexes", "file_hashes.json"))
+    saves = []
+    original_save = cache.save
+    cache.save = lambda: saves.append(1) or original_save()
+    paths = []
+    for i in range(50):
+        paths.append(os.path.join(folder, f"sample_{i}.jpg"))
+        write_file(paths[-1], f"sample {i}".encode("utf-8"))
+        cache.get(paths[-1])
+    assert saves == []  # Debounced
+    cache.flush()
+    cache.flush()
+    assert len(saves) == 1
+
+    os.remove(paths[0])
+    reloaded = handler.FileHashCache(cache.cache_path)
+    assert reloaded.lookup(paths[1]) == hashlib.sha256(b"sample 1").hexdigest()
+    assert paths[0] not in reloaded.hashes and len(reloaded.hashes) == 49
+    reloaded.flush()
+    with open(cache.cache_path) as f:
+        assert len(json.load(f)) == 49
+    print("   ✅ 50 hashes saved once, deleted file pruned")
+    return True
+
+def test_safetensors_introspection():
+    """list_models reports tensor details read from the header only, cached by size/mtime."""
+    print("\n🧪 Testing safetensors header introspection...")
+    tensors = {}
+    for block in range(3):
+        for leaf in ("to_q", "to_k"):
+            module = f"transformer.single_transformer_blocks.{block}.attn.{leaf}"
+            tensors[f"{module}.lora_A.weight"] = ("BF16", (16, 64))
+            tensors[f"{module}.lora_B.weight"] = ("BF16", (64, 16))
+    metadata = {"name": "insp_lora", "training_info": json.dumps({"step": 500, "epoch": 2}), "software": "ai-toolkit"}
+    model_path = os.path.join(handler.TRAINING_OUTPUT_ROOT, "insp01", "insp_lora.safetensors")
+    write_fake_safetensors(model_path, tensors, metadata)
+    write_fake_safetensors(os.path.join(handler.TRAINING_OUTPUT_ROOT, "insp01", "broken.safetensors"), tensors, truncate=100)
+    write_file(os.path.join(handler.TRAINING_OUTPUT_ROOT, "insp01", "garbage.safetensors"), b"\xff" * 16)
+
+    reads = []
+    original_read = handler.read_safetensors_header
+    handler.read_safetensors_header = lambda path: reads.append(path) or original_read(path)
+    try:
+        listing = handle_list_trained_models({"folder": "insp01", "refresh": True, "sort_by": "name", "order": "asc"})
+        handle_list_trained_models({"folder": "insp01"})
+    finally:
+        handler.read_safetensors_header = original_read
+    by_name = {m["filename"]: m["safetensors"] for m in listing["models"]}
+
+    info = by_name["insp_lora.safetensors"]
+    assert info["tensor_count"] == 12 and info["dtypes"] == {"BF16": 12}
+    assert info["rank"] == 16 and info["ranks"] is None
+    assert info["module_count"] == 6 and info["target_modules"] == ["to_k", "to_q"]
+    assert info["parameter_count"] == 12 * 16 * 64
+    assert info["metadata"]["training_info"] == {"step": 500, "epoch": 2}
+    assert not info["truncated"] and info["header_bytes"] < 4096
+    assert by_name["broken.safetensors"]["truncated"]
+    assert "error" in by_name["garbage.safetensors"]
+    assert len(reads) == 3, "second listing must be served from the cache"
+    print(f"   ✅ rank {info['rank']}, {info['parameter_count']} params from {info['header_bytes']} header bytes")
+    return True
+
+def test_bulk_download_export():
+    """bulk_download builds a tar on demand; chunks reassemble into the original artifacts."""
+    print("\n🧪 Testing bulk download export...")
+    _, run_folder = fake_finished_run("bulk01", name="bulk_lora")
+    fake_finished_run("bulk02", name="other_lora")
+    complete_training_process("bulk01")
+    complete_training_process("bulk02")
+
+    export = handle_bulk_download({"process_ids": ["bulk01", "bulk02", "nope"], "include_images": True})
+    assert export["status"] == "success", export
+    assert export["total_files"] == 8 and export["missing"] == ["nope"]
+    assert "bulk01/samples/1_000000250_0.jpg" in [f["name"] for f in export["files"]]
+    assert os.path.exists(os.path.join(handler.BULK_EXPORT_DIR, f"{export['token']}.json"))
+
+    with PROCESS_LOCK:
+        BULK_EXPORT_LAYOUTS.clear()  # Chunks may be served by another worker
+    client = ChunkedModelDownloader(lambda job_type, data: handle_bulk_download(data),
+                                    chunk_size=1000, workers=3, retry_delay=0, job_type="bulk_download")
+    dest = os.path.join(tempfile.mkdtemp(), export["filename"])
+    result = client.download({"token": export["token"]}, dest)
+    assert result["size_bytes"] == export["total_size"] == os.path.getsize(dest)
+
+    with tarfile.open(dest) as archive:
+        names = archive.getnames()
+        assert len(names) == 8
+        assert archive.extractfile("bulk01/bulk_lora.safetensors").read() == b"final-weights"
+        assert archive.extractfile("bulk02/other_lora_000000500.safetensors").read() == b"ckpt-500"
+
+    loras_only = handle_bulk_download({"process_ids": ["bulk01"], "include_images": False})
+    assert loras_only["total_files"] == 3 and not any("samples" in f["name"] for f in loras_only["files"])
+
+    time.sleep(0.01)
+    write_file(os.path.join(run_folder, "bulk_lora.safetensors"), b"retrained-weights")
+    stale = handle_bulk_download({"token": export["token"], "offset": 0, "length": export["total_size"]})
+    assert stale["status"] == "error" and "stale" in stale["error"]
+    assert handle_bulk_download({"token": "../../etc/passwd"})["status"] == "error"
+    assert handle_bulk_download({"process_ids": []})["status"] == "error"
+    print(f"   ✅ {len(names)} files, {result['size_bytes']} bytes in {result['chunks_fetched']} chunks")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL MODEL ARTIFACT TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_process_output_dir,
+        test_artifact_manifest,
+        test_download_via_manifest,
+        test_model_index_directory_cache,
+        test_list_models_paging,
+        test_chunked_download,
+        test_conditional_download,
+        test_hash_cache_batched_saves,
+        test_safetensors_introspection,
+        test_bulk_download_export,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
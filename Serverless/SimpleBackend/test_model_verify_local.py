@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR MODEL VERIFICATION
+Tests the base model deep verification and fingerprint locally with a fake diffusers layout
+
+This tests:
+- Deep verification (components, repo file sizes, shard indexes, safetensors sizes)
+- Truncated shards and missing files are detected
+- Fingerprint marker makes later checks stat-only
+- Changed files invalidate the fingerprint
+"""
+
+import sys
+import os
+import json
+import shutil
+import struct
+import tempfile
+import time
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_verify_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import handler
+from handler import (
+    deep_verify_model_dir, verify_model_dir, check_model_fingerprint, fetch_hf_repo_files,
+    MODEL_FINGERPRINT_FILENAME
+)
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def write_safetensors(path, floats, truncate=0):
+    """One F32 tensor of `floats` values; truncate drops bytes from the end (partial download)."""
+    raw = json.dumps({"w": {"dtype": "F32", "shape": [floats], "data_offsets": [0, floats * 4]}}).encode("utf-8")
+    write_file(path, struct.pack("<Q", len(raw)) + raw + b"\0" * (floats * 4 - truncate))
+
+def make_model_dir():
+    """Minimal FLUX-like layout: model_index, components, a sharded transformer."""
+    path = os.path.join(tempfile.mkdtemp(), "FLUX.1-dev")
+    write_file(os.path.join(path, "model_index.json"), json.dumps({
+        "_class_name": "FluxPipeline",
+        "scheduler": ["diffusers", "FlowMatchEulerDiscreteScheduler"],
+        "transformer": ["diffusers", "FluxTransformer2DModel"],
+        "vae": ["diffusers", "AutoencoderKL"]
+    }).encode("utf-8"))
+    write_file(os.path.join(path, "scheduler", "scheduler_config.json"), b"{}")
+    write_safetensors(os.path.join(path, "vae", "diffusion_pytorch_model.safetensors"), 16)
+    shards = ["diffusion_pytorch_model-00001-of-00002.safetensors", "diffusion_pytorch_model-00002-of-00002.safetensors"]
+    for shard in shards:
+        write_safetensors(os.path.join(path, "transformer", shard), 64)
+    write_file(os.path.join(path, "transformer", "diffusion_pytorch_model.safetensors.index.json"),
+               json.dumps({"weight_map": {"a": shards[0], "b": shards[1]}}).encode("utf-8"))
+    # Download cache of huggingface-cli is not part of the model
+    write_file(os.path.join(path, ".cache", "huggingface", "download", "x.metadata"), b"etag")
+    return path
+
+def repo_listing(path):
+    return {rel: os.path.getsize(os.path.join(path, rel)) for rel in handler.iter_model_files(path)}
+
+def test_deep_verification():
+    """A complete dir verifies; missing components, shards, sizes and truncation are reported."""
+    print("🧪 Testing deep verification...")
+    path = make_model_dir()
+    listing = repo_listing(path)
+    assert deep_verify_model_dir(path, listing) == []
+
+    shard = os.path.join(path, "transformer", "diffusion_pytorch_model-00002-of-00002.safetensors")
+    write_safetensors(shard, 64, truncate=100)
+    problems = deep_verify_model_dir(path)
+    assert len(problems) == 1 and "header describes" in problems[0], problems
+
+    os.remove(shard)
+    problems = deep_verify_model_dir(path, listing)
+    assert any("shard diffusion_pytorch_model-00002" in p for p in problems)
+    assert any(p.endswith("00002-of-00002.safetensors: missing") for p in problems)
+
+    write_safetensors(shard, 64)
+    listing["scheduler/scheduler_config.json"] = 999
+    assert deep_verify_model_dir(path, listing) == ["scheduler/scheduler_config.json: 2 bytes, expected 999"]
+    assert deep_verify_model_dir(path, listing, allow_patterns=["transformer/*", "vae/*"]) == []
+
+    shutil.rmtree(os.path.join(path, "vae"))
+    assert "vae: component folder missing" in deep_verify_model_dir(path)
+    print("   ✅ Truncated shard, missing shard, size mismatch and missing component detected")
+    return True
+
+def test_fingerprint_fast_path():
+    """After one deep check, verification is a stat-compare against the marker."""
+    print("\n🧪 Testing fingerprint fast path...")
+    path = make_model_dir()
+    assert not check_model_fingerprint(path)
+    assert verify_model_dir(path)
+    with open(os.path.join(path, MODEL_FINGERPRINT_FILENAME)) as f:
+        fingerprint = json.load(f)
+    assert "model_index.json" in fingerprint["files"]
+    assert not any(rel.startswith(".cache") for rel in fingerprint["files"])
+
+    def fail_deep_check(*args, **kwargs):
+        raise AssertionError("deep check ran although the fingerprint matches")
+
+    original = handler.deep_verify_model_dir
+    handler.deep_verify_model_dir = fail_deep_check
+    try:
+        start = time.perf_counter()
+        for _ in range(100):
+            assert verify_model_dir(path)
+        per_check = (time.perf_counter() - start) / 100
+    finally:
+        handler.deep_verify_model_dir = original
+
+    # The staging dir is renamed into place: mtimes survive, so the fingerprint stays valid
+    moved = path + "-published"
+    os.rename(path, moved)
+    assert check_model_fingerprint(moved)
+    print(f"   ✅ Fingerprint check {per_check * 1e6:.0f}µs, survives the publish rename")
+    return True
+
+def test_fingerprint_invalidation():
+    """A file changed or removed after verification forces a new deep check."""
+    print("\n🧪 Testing fingerprint invalidation...")
+    path = make_model_dir()
+    assert verify_model_dir(path)
+
+    shard = os.path.join(path, "transformer", "diffusion_pytorch_model-00001-of-00002.safetensors")
+    write_safetensors(shard, 64, truncate=8)  # e.g. an interrupted re-download
+    assert not check_model_fingerprint(path)
+    assert not verify_model_dir(path)
+
+    write_safetensors(shard, 64)
+    assert verify_model_dir(path) and check_model_fingerprint(path)
+    os.remove(os.path.join(path, "scheduler", "scheduler_config.json"))
+    assert not check_model_fingerprint(path)
+
+    # Repo listings come from the volume cache when present (no Hub access needed)
+    repo_id = f"test/repo-{os.getpid()}"
+    os.makedirs(handler.HF_REPO_FILES_DIR, exist_ok=True)
+    with open(os.path.join(handler.HF_REPO_FILES_DIR, f"{repo_id.replace('/', '--')}@main.json"), "w") as f:
+        json.dump({"model_index.json": 1}, f)
+    assert fetch_hf_repo_files(repo_id) == {"model_index.json": 1}
+    fresh = make_model_dir()
+    assert not verify_model_dir(fresh, repo_id)  # model_index.json size differs from the listing
+    assert not os.path.exists(os.path.join(fresh, MODEL_FINGERPRINT_FILENAME))
+    print("   ✅ Changed shard and removed file invalidate the fingerprint")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL MODEL VERIFICATION TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_deep_verification,
+        test_fingerprint_fast_path,
+        test_fingerprint_invalidation,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR RETENTION GC
+Tests the output retention / disk quota garbage collector locally with fake outputs
+
+This tests:
+- Keep the newest N checkpoints and final weights, expire old samples
+- dry_run report vs. real pass (manifests pruned after deletions)
+- Active processes: outputs, configs, datasets and resume checkpoints are protected
+- Per-user quotas (samples first, newest checkpoint and finals kept)
+- Background pass with gc_status and the I/O throttle
+- Planning from the model / sample / dataset indexes (no tree walk); one pass at a time
+"""
+
+import sys
+import os
+import json
+import tempfile
+import time
+import uuid
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_gc_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import handler
+from handler import (
+    add_process, update_process_status, update_process_fields, write_artifact_manifest,
+    handle_gc, handle_gc_status, parse_gc_policy, IoThrottle
+)
+
+DAY = 86400
+
+class IsolatedVolume:
+    """Point the GC (and the indexes it plans from) at fresh output / training_data / config locations."""
+
+    def __enter__(self):
+        root = tempfile.mkdtemp(prefix="gc_volume_")
+        self.saved = (handler.TRAINING_OUTPUT_ROOT, handler.TRAINING_DATA_ROOT, handler.GC_CONFIG_GLOB,
+                      handler.MODEL_INDEX, handler.SAMPLE_IMAGE_INDEX, handler.DATASET_IMAGE_INDEX)
+        handler.TRAINING_OUTPUT_ROOT = os.path.join(root, "output")
+        handler.TRAINING_DATA_ROOT = os.path.join(root, "training_data")
+        self.config_dir = os.path.join(root, "tmp")
+        handler.GC_CONFIG_GLOB = os.path.join(self.config_dir, "training_config_*.yaml")
+        for path in (handler.TRAINING_OUTPUT_ROOT, handler.TRAINING_DATA_ROOT, self.config_dir):
+            os.makedirs(path)
+        indexes = os.path.join(root, "indexes")
+        handler.MODEL_INDEX = handler.ModelIndex(handler.TRAINING_OUTPUT_ROOT, os.path.join(indexes, "models.json"))
+        handler.SAMPLE_IMAGE_INDEX = handler.ModelIndex(
+            handler.TRAINING_OUTPUT_ROOT, os.path.join(indexes, "samples.json"),
+            extensions=handler.SAMPLE_EXTENSIONS, skip_dirs=self.saved[4].skip_dirs)
+        handler.DATASET_IMAGE_INDEX = handler.ModelIndex(
+            handler.TRAINING_DATA_ROOT, os.path.join(indexes, "datasets.json"),
+            extensions=handler.DATASET_IMAGE_EXTENSIONS, skip_dirs=self.saved[5].skip_dirs)
+        return self
+
+    def __exit__(self, *exc):
+        (handler.TRAINING_OUTPUT_ROOT, handler.TRAINING_DATA_ROOT, handler.GC_CONFIG_GLOB,
+         handler.MODEL_INDEX, handler.SAMPLE_IMAGE_INDEX, handler.DATASET_IMAGE_INDEX) = self.saved
+
+def write_file(path, size=1024, age_days=0.0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    mtime = time.time() - age_days * DAY
+    os.utime(path, (mtime, mtime))
+    return path
+
+def fake_run(status="completed", checkpoints=5, samples=((20, 1), (1, 1)), user_id=None, size=1024):
+    """Process with checkpoints (oldest first), final weights and (age_days, count) samples."""
+    process_id = f"gc{uuid.uuid4().hex[:6]}"
+    folder = os.path.join(handler.TRAINING_OUTPUT_ROOT, process_id, "my_lora")
+    config = {"config": {"name": "my_lora", "process": [{"training_folder": os.path.dirname(folder)}]}}
+    paths = {"checkpoints": [], "samples": []}
+    for i in range(checkpoints):
+        step = (i + 1) * 250
+        paths["checkpoints"].append(write_file(os.path.join(folder, f"my_lora_{step:09d}.safetensors"),
+                                               size, age_days=(checkpoints - i) / 24))
+    if status == "completed":
+        paths["final"] = write_file(os.path.join(folder, "my_lora.safetensors"), size)
+    for age_days, count in samples:
+        for i in range(count):
+            paths["samples"].append(write_file(os.path.join(folder, "samples", f"{age_days}d_{i}.jpg"),
+                                               size, age_days=age_days))
+    add_process(process_id, "train_yaml", status, config)
+    update_process_fields(process_id, user_id=user_id or handler.DEFAULT_USER_ID)
+    if status == "completed":
+        write_artifact_manifest(process_id)
+    return process_id, paths
+
+def actions_by_kind(report):
+    kinds = {}
+    for action in report["actions"]:
+        kinds.setdefault(action["kind"], set()).add(action["path"])
+    return kinds
+
+def test_checkpoint_and_sample_retention():
+    """Old checkpoints and samples go, the newest 3 checkpoints, final and fresh samples stay."""
+    print("🧪 Testing checkpoint / sample retention...")
+    with IsolatedVolume():
+        process_id, paths = fake_run()
+
+        dry = handle_gc({})["report"]
+        assert dry["dry_run"] and dry["deleted"]["files"] == 0
+        planned = actions_by_kind(dry)
+        assert planned["checkpoint"] == set(paths["checkpoints"][:2])
+        assert planned["sample"] == {paths["samples"][0]}
+        assert "final" not in planned and all(os.path.exists(p) for p in paths["checkpoints"])
+
+        report = handle_gc({"dry_run": False})["report"]
+        assert report["deleted"]["files"] == 3 and not report["errors"], report
+        assert [os.path.exists(p) for p in paths["checkpoints"]] == [False, False, True, True, True]
+        assert os.path.exists(paths["final"]) and os.path.exists(paths["samples"][1])
+
+        with open(os.path.join(handler.TRAINING_OUTPUT_ROOT, process_id, "my_lora", "manifest.json")) as f:
+            manifest = json.load(f)
+        assert [c["step"] for c in manifest["checkpoints"]] == [750, 1000, 1250]
+        assert len(manifest["samples"]) == 1 and manifest["final"]
+        assert handler.get_artifact_manifest(process_id)["checkpoints"][0]["step"] == 750
+
+        keep_one = handle_gc({"policy": {"keep_checkpoints": 1}})["report"]
+        assert keep_one["planned"]["checkpoint"]["count"] == 2
+    print("   ✅ 2 checkpoints and 1 sample removed, manifest pruned")
+    return True
+
+def test_active_process_protection():
+    """Nothing an active run uses is collected: outputs, config, dataset, resume checkpoint."""
+    print("\n🧪 Testing active process protection...")
+    with IsolatedVolume() as volume:
+        running_id, running_paths = fake_run(status="running", samples=((30, 1),))
+        failed_id, failed_paths = fake_run(status="failed")
+
+        dataset = os.path.join(handler.TRAINING_DATA_ROOT, "worker_a", "set_1")
+        write_file(os.path.join(dataset, "a.jpg"), age_days=30)
+        os.utime(dataset, (time.time() - 30 * DAY,) * 2)
+        stale_set = os.path.join(handler.TRAINING_DATA_ROOT, "worker_a", "set_2")
+        write_file(os.path.join(stale_set, "b.jpg"), age_days=30)
+        os.utime(stale_set, (time.time() - 30 * DAY,) * 2)
+
+        # The running process resumes from the failed run's oldest checkpoint and trains on set_1
+        process_config = handler.get_process(running_id)["config"]["config"]["process"][0]
+        process_config["datasets"] = [{"folder_path": dataset}]
+        update_process_fields(running_id, resume_checkpoint={"path": failed_paths["checkpoints"][0], "step": 250})
+
+        running_config = write_file(os.path.join(volume.config_dir, f"training_config_{running_id}.yaml"), age_days=3)
+        old_config = write_file(os.path.join(volume.config_dir, "training_config_old123.yaml"), age_days=3)
+        new_config = write_file(os.path.join(volume.config_dir, "training_config_new123.yaml"))
+
+        report = handle_gc({"dry_run": False})["report"]
+        assert running_id in report["active_processes"]
+        assert all(os.path.exists(p) for p in running_paths["checkpoints"] + running_paths["samples"])
+        assert os.path.exists(failed_paths["checkpoints"][0])          # Resume checkpoint of the running run
+        assert not os.path.exists(failed_paths["checkpoints"][1])      # Beyond the newest 3 otherwise
+        assert os.path.exists(dataset) and not os.path.exists(stale_set)
+        assert os.path.exists(running_config) and os.path.exists(new_config) and not os.path.exists(old_config)
+
+        # A "running" record nobody updated for longer than the training timeout is not protected
+        with handler.PROCESS_LOCK:
+            handler.RUNNING_PROCESSES[running_id]["updated_at"] = "2000-01-01T00:00:00"
+        stale = handle_gc({})["report"]
+        assert running_id not in stale["active_processes"]
+        assert set(running_paths["checkpoints"][:2]) <= actions_by_kind(stale)["checkpoint"]
+    print("   ✅ Active outputs, config, dataset and resume checkpoint kept")
+    return True
+
+def test_user_quota():
+    """Over-quota users lose samples first, then older checkpoints; newest checkpoint and final stay."""
+    print("\n🧪 Testing per-user quotas...")
+    with IsolatedVolume():
+        size = 1024 * 1024
+        alice_id, alice = fake_run(user_id="alice", checkpoints=3, samples=((1, 2),), size=size)
+        bob_id, bob = fake_run(user_id="bob", checkpoints=3, samples=((1, 2),), size=size)
+
+        # alice: 6 MB (+ manifest) with a 4.5 MB quota -> 2 samples go; bob has no quota
+        policy = {"user_quotas": {"alice": 4.5 / 1024}}
+        report = handle_gc({"dry_run": False, "policy": policy})["report"]
+        assert not any(os.path.exists(p) for p in alice["samples"])
+        assert all(os.path.exists(p) for p in alice["checkpoints"] + [alice["final"]])
+        assert all(os.path.exists(p) for p in bob["samples"] + bob["checkpoints"])
+        assert report["usage"]["alice"]["quota_bytes"] and not report["usage"]["alice"]["over_quota"]
+        assert report["usage"]["bob"]["quota_bytes"] is None
+
+        # 2 MB quota: older checkpoints go too, the newest checkpoint and the final are kept -> still over
+        report = handle_gc({"dry_run": False, "policy": {"user_quotas": {"alice": 2 / 1024}}})["report"]
+        assert [os.path.exists(p) for p in alice["checkpoints"]] == [False, False, True]
+        assert os.path.exists(alice["final"]) and report["usage"]["alice"]["over_quota"]
+        assert report["usage"]["alice"]["after_bytes"] > report["usage"]["alice"]["quota_bytes"]
+
+        # Without keep_final the final weights may go as well
+        dry = handle_gc({"policy": {"user_quotas": {"alice": 1.5 / 1024}, "keep_final": False}})["report"]
+        assert actions_by_kind(dry)["final"] == {alice["final"]}
+
+        # Uploaded sets are attributed through the User ID line of _training_info.txt
+        folder = os.path.join(handler.TRAINING_DATA_ROOT, "w1", "carol_set")
+        write_file(os.path.join(folder, "a.jpg"), size=size)
+        with open(os.path.join(folder, "_training_info.txt"), "w") as f:
+            f.write("Training Name: q\nUser ID: carol\n")
+        report = handle_gc({"policy": {"user_quota_gb": 0.5 / 1024}})["report"]
+        assert folder in actions_by_kind(report)["training_data"]
+    print("   ✅ Quota victims: samples, then older checkpoints; finals only without keep_final")
+    return True
+
+def test_background_gc_and_throttle():
+    """gc background=true runs off the request path; gc_status reports it; throttle limits rate."""
+    print("\n🧪 Testing background GC and I/O throttle...")
+    with IsolatedVolume():
+        _, paths = fake_run(checkpoints=6)
+        started = handler.handler({"input": {"type": "gc", "background": True, "dry_run": False}})
+        assert started["status"] == "success", started
+        deadline = time.time() + 10
+        while handle_gc_status()["running"] and time.time() < deadline:
+            time.sleep(0.05)
+        status = handle_gc_status()
+        assert not status["running"] and status["report"]["state"] == "finished"
+        assert status["report"]["deleted"]["files"] == 4  # 3 checkpoints + 1 old sample
+        assert sum(os.path.exists(p) for p in paths["checkpoints"]) == 3
+
+    throttle = IoThrottle(bytes_per_second=0, files_per_second=100)
+    start = time.monotonic()
+    for _ in range(20):
+        throttle.consume(1)
+    assert time.monotonic() - start >= 0.19
+
+    assert handle_gc({"policy": {"keep_checkpoints": -1}})["status"] == "error"
+    assert handle_gc({"policy": {"bogus": 1}})["status"] == "error"
+    assert parse_gc_policy({"keep_checkpoints": "2"})["keep_checkpoints"] == 2
+    print("   ✅ Background pass finished, 20 deletions throttled to 100/s")
+    return True
+
+def test_indexed_plan_and_single_pass():
+    """Plans come from the indexes without walking the trees; foreground and background passes exclude each other."""
+    print("\n🧪 Testing index-backed planning and pass serialization...")
+    with IsolatedVolume():
+        _, paths = fake_run()
+        folder = os.path.join(handler.TRAINING_DATA_ROOT, "w1", "set_1")
+        write_file(os.path.join(folder, "a.jpg"), size=3000)
+        write_file(os.path.join(folder, "_latent_cache", "a.safetensors"), size=5000)
+        first = handle_gc({})["report"]
+
+        original_walk = os.walk
+        def no_walk(*args, **kwargs):
+            raise AssertionError(f"tree walked: {args}")
+        os.walk = no_walk
+        try:
+            again = handle_gc({})["report"]
+        finally:
+            os.walk = original_walk
+        assert again["planned"] == first["planned"] and again["usage"] == first["usage"]
+        assert actions_by_kind(again)["checkpoint"] == set(paths["checkpoints"][:2])
+        assert again["usage"][handler.DEFAULT_USER_ID]["bytes"] >= 8000 + 8 * 1024  # Dataset incl. latent cache
+
+        assert handler.RETENTION_GC.pass_lock.acquire(blocking=False)  # A pass is running
+        try:
+            assert "already running" in handle_gc({})["error"]
+            assert "already running" in handle_gc({"background": True})["error"]
+            assert handle_gc_status()["running"]
+        finally:
+            handler.RETENTION_GC.pass_lock.release()
+        assert handle_gc({})["status"] == "success"
+    print("   ✅ Second plan without a tree walk, concurrent passes refused")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL RETENTION GC TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_checkpoint_and_sample_retention,
+        test_active_process_protection,
+        test_user_quota,
+        test_background_gc_and_throttle,
+        test_indexed_plan_and_single_pass,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR STAGE-IN CACHE
+Tests copying the base model and datasets from the volume to local disk with temp directories
+
+This tests:
+- Parallel chunked copies (contents and mtimes preserved)
+- Hits for unchanged sources, re-copies for changed ones
+- LRU eviction within the size budget; pinned copies are never evicted
+- Copies still in flight count against the budget
+- Training config rewriting (the whole training_data root is never staged) and hit/miss stats in health
+"""
+
+import sys
+import os
+import tempfile
+import threading
+import time
+import uuid
+import yaml
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_stage_in_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import handler
+from handler import StageInCache, stage_in_training_config, add_process, get_process
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def make_source(size=10000, name="model"):
+    """A volume-side folder with a nested layout, an empty file and an odd-sized file."""
+    path = os.path.join(tempfile.mkdtemp(), name)
+    write_file(os.path.join(path, "transformer", "weights.safetensors"), os.urandom(size))
+    write_file(os.path.join(path, "vae", "weights.safetensors"), os.urandom(size // 3 + 7))
+    write_file(os.path.join(path, "model_index.json"), b"{}")
+    write_file(os.path.join(path, "empty.txt"), b"")
+    old = time.time() - 3600
+    for root, _, files in os.walk(path):
+        for name in files:
+            os.utime(os.path.join(root, name), (old, old))
+    return path
+
+def same_tree(a, b):
+    listing_a, listing_b = handler.stage_in_listing(a), handler.stage_in_listing(b)
+    if listing_a != listing_b:
+        return False
+    for rel in listing_a:
+        with open(os.path.join(a, rel), "rb") as fa, open(os.path.join(b, rel), "rb") as fb:
+            if fa.read() != fb.read():
+                return False
+    return True
+
+def new_cache(max_bytes=10 ** 9):
+    return StageInCache(tempfile.mkdtemp(prefix="stage_in_"), max_bytes, workers=4, chunk_bytes=1000)
+
+def test_copy_and_hits():
+    """A chunked copy matches the source; unchanged sources hit, changed ones are copied again."""
+    print("🧪 Testing stage-in copies and hits...")
+    cache, source = new_cache(), make_source()
+    local = cache.acquire(source)
+    assert local != source and local.startswith(cache.root) and os.path.basename(local) == "model"
+    assert same_tree(source, local)
+    cache.release(local)
+
+    assert cache.acquire(source) == local
+    cache.release(local)
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["hit_rate"] == 0.5, stats
+    assert stats["used_bytes"] == stats["copied_bytes"] == handler.tree_size_and_mtime(source)[0]
+
+    # A re-uploaded file on the volume invalidates the copy
+    write_file(os.path.join(source, "vae", "weights.safetensors"), b"new weights")
+    fresh = cache.acquire(source)
+    assert fresh != local and not os.path.exists(local) and same_tree(source, fresh)
+    cache.release(fresh)
+
+    # A single file is staged too
+    single = cache.acquire(os.path.join(source, "model_index.json"))
+    assert os.path.isfile(single) and open(single, "rb").read() == b"{}"
+    print(f"   ✅ {stats['copied_bytes']} bytes in 1000-byte chunks, hit rate {cache.stats()['hit_rate']}")
+    return True
+
+def test_lru_eviction_and_pins():
+    """Least recently used copies make room; pinned ones stay and the volume path is used instead."""
+    print("\n🧪 Testing LRU eviction and pins...")
+    a, b, c = make_source(name="a"), make_source(name="b"), make_source(name="c")
+    size = handler.tree_size_and_mtime(a)[0]
+    cache = new_cache(max_bytes=2 * size + 10)
+
+    local_a = cache.acquire(a)
+    cache.release(local_a)
+    local_b = cache.acquire(b)
+    cache.release(local_b)
+    assert cache.acquire(a) == local_a  # a is now more recent than b
+    cache.release(local_a)
+    local_c = cache.acquire(c)
+    assert not os.path.exists(local_b) and os.path.exists(local_a)
+    assert cache.stats()["evictions"] == 1
+
+    # a is released but c is still in use: b evicts a, then nothing else fits
+    local_b = cache.acquire(b)
+    assert not os.path.exists(local_a) and local_b != b
+    assert cache.acquire(a) == a  # Both copies pinned -> read from the volume
+    assert os.path.exists(local_b) and os.path.exists(local_c)
+    assert cache.stats()["bypassed"] == 1 and cache.stats()["pinned"] == 2
+
+    assert StageInCache(tempfile.mkdtemp(), 0).acquire(a) == a  # Disabled
+    print(f"   ✅ {cache.stats()['evictions']} evictions, pinned copies kept")
+    return True
+
+def test_in_flight_copies_reserve_budget():
+    """A copy still running holds its size: a second source that would not fit next to it is not staged."""
+    print("\n🧪 Testing budget reservation for copies in flight...")
+    a, b = make_source(name="a"), make_source(name="b")
+    size = handler.tree_size_and_mtime(a)[0]
+    cache = new_cache(max_bytes=size + size // 2)
+
+    started, finish = threading.Event(), threading.Event()
+    original_copy = handler.copy_file_chunk
+    def slow_copy(source_path, *args):
+        if source_path.startswith(a):
+            started.set()
+            finish.wait(10)
+        original_copy(source_path, *args)
+    handler.copy_file_chunk = slow_copy
+    try:
+        results = {}
+        copier = threading.Thread(target=lambda: results.update(a=cache.acquire(a)))
+        copier.start()
+        assert started.wait(10)
+        assert cache.stats()["copying_bytes"] == size and cache.used_bytes() == size
+        assert cache.acquire(b) == b  # Would overrun the budget once a lands
+        finish.set()
+        copier.join(10)
+    finally:
+        finish.set()
+        handler.copy_file_chunk = original_copy
+    assert results["a"] != a and same_tree(a, results["a"])
+    stats = cache.stats()
+    assert stats["bypassed"] == 1 and stats["copying_bytes"] == 0 and stats["used_bytes"] == size, stats
+    print("   ✅ Second source read from the volume while the first copy was running")
+    return True
+
+def test_index_survives_restart():
+    """A new handler process in the same container reuses copies and drops interrupted ones."""
+    print("\n🧪 Testing reuse after a handler restart...")
+    cache, source = new_cache(), make_source()
+    local = cache.acquire(source)
+    cache.release(local)
+    os.makedirs(os.path.join(cache.root, "deadbeef-123456.partial", "model"))
+
+    restarted = StageInCache(cache.root, cache.max_bytes, workers=2, chunk_bytes=4096)
+    assert restarted.acquire(source) == local
+    assert restarted.stats()["hits"] == 1
+    assert not os.path.exists(os.path.join(cache.root, "deadbeef-123456.partial"))
+    print("   ✅ Copy reused, partial copy removed")
+    return True
+
+def test_training_config_rewrite():
+    """Model and dataset folders in the config point at local copies; Hub ids are left alone."""
+    print("\n🧪 Testing training config rewrite...")
+    model, dataset = make_source(name="FLUX.1-dev"), make_source(size=500, name="dataset")
+    config = {"job": "extension", "config": {"name": "x", "process": [{
+        "model": {"name_or_path": model},
+        "datasets": [{"folder_path": dataset}, {"folder_path": "/does/not/exist"},
+                     {"folder_path": handler.TRAINING_DATA_ROOT}]
+    }, {"model": {"name_or_path": "black-forest-labs/FLUX.1-dev"}}]}}
+    os.makedirs(handler.TRAINING_DATA_ROOT, exist_ok=True)
+    process_id = f"st_{uuid.uuid4().hex[:6]}"
+    config_path = handler.write_training_config(config, process_id)
+    add_process(process_id, "train", "running", config)
+
+    original_cache = handler.STAGE_IN
+    handler.STAGE_IN = new_cache()
+    try:
+        run_path, staged = stage_in_training_config(process_id, config_path)
+        assert run_path == f"/tmp/training_config_{process_id}_staged.yaml" and len(staged) == 2
+        with open(run_path) as f:
+            run_config = yaml.safe_load(f)
+        first, second = run_config["config"]["process"]
+        assert first["model"]["name_or_path"] == staged[0] and same_tree(model, staged[0])
+        assert first["datasets"][0]["folder_path"] == staged[1] and same_tree(dataset, staged[1])
+        assert first["datasets"][1]["folder_path"] == "/does/not/exist"
+        assert first["datasets"][2]["folder_path"] == handler.TRAINING_DATA_ROOT  # Every upload: not copied
+        assert second["model"]["name_or_path"] == "black-forest-labs/FLUX.1-dev"
+        with open(config_path) as f:
+            assert yaml.safe_load(f) == config
+        assert get_process(process_id)["stage_in"] == {model: staged[0], dataset: staged[1]}
+
+        health = handler.handler({"input": {"type": "health"}})
+        assert health["stage_in"]["misses"] == 2 and health["stage_in"]["pinned"] == 2
+        for local_path in staged:
+            handler.STAGE_IN.release(local_path)
+        assert handler.STAGE_IN.stats()["pinned"] == 0
+    finally:
+        handler.STAGE_IN = original_cache
+    print("   ✅ Model and dataset rewritten, original config untouched")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL STAGE-IN CACHE TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_copy_and_hits,
+        test_lru_eviction_and_pins,
+        test_in_flight_copies_reserve_budget,
+        test_index_survives_restart,
+        test_training_config_rewrite,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
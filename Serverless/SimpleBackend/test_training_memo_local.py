@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR TRAINING MEMOIZATION
+Tests that resubmitting the same YAML against the same photos reuses the earlier run (no GPU needed)
+
+This tests:
+- Fingerprint: normalized config + dataset content hashes (folder name, key order, device ignored)
+- train_with_yaml attaches to an identical in-flight run
+- Completed runs return their artifacts; removed artifacts or failed runs train again
+- force=true always starts a new run
+- The training_data root and files not hashed yet are never memoized or hashed inline
+"""
+
+import sys
+import os
+import tempfile
+import time
+import uuid
+import yaml
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_memo_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import handler
+from handler import (
+    training_fingerprint, handle_train_with_yaml, get_process, update_process_status, TRAINING_MEMO,
+    pack_dataset_folder, TRAINING_DATA_ROOT, FILE_HASHES
+)
+
+def hash_dataset(folder):
+    """Hashes as upload_training_data records them while writing the files."""
+    for name in os.listdir(folder):
+        if os.path.isfile(os.path.join(folder, name)):
+            FILE_HASHES.get(os.path.join(folder, name))
+
+def make_dataset(captions=("photo of sks, smiling", "photo of sks, outdoors")):
+    folder = os.path.join(TRAINING_DATA_ROOT, "worker1", f"memo_{uuid.uuid4().hex[:8]}")
+    os.makedirs(folder)
+    for i, caption in enumerate(captions):
+        with open(os.path.join(folder, f"img_{i}.jpg"), "wb") as f:
+            f.write(f"jpeg bytes {i}".encode("utf-8"))
+        with open(os.path.join(folder, f"img_{i}.txt"), "w") as f:
+            f.write(caption)
+    with open(os.path.join(folder, "_training_info.txt"), "w") as f:
+        f.write(f"Upload Date: {time.time()}\n")
+    hash_dataset(folder)
+    return folder
+
+def make_config(name=None, steps=100):
+    return {
+        "job": "extension",
+        "config": {
+            "name": name or f"memo_{uuid.uuid4().hex[:6]}",
+            "process": [{"type": "sd_trainer", "device": "cuda:0", "training_folder": "output",
+                         "model": {"name_or_path": "black-forest-labs/FLUX.1-dev", "is_flux": True},
+                         "datasets": [{"folder_path": "placeholder", "caption_ext": "txt"}],
+                         "train": {"steps": steps, "lr": 0.0001}}]
+        }
+    }
+
+class NoTraining:
+    """Record launches instead of preparing / training."""
+
+    def __enter__(self):
+        self.launched = []
+        self.original = handler.prepare_training_in_background
+        handler.prepare_training_in_background = lambda process_id, *args: self.launched.append(process_id)
+        return self
+
+    def __exit__(self, *exc):
+        handler.prepare_training_in_background = self.original
+
+def submit(config, dataset, **options):
+    return handle_train_with_yaml({"yaml_config": yaml.dump(config), "dataset_path": dataset, **options})
+
+def test_fingerprint_normalization():
+    """Same config + same photos -> same fingerprint, whatever the folder, key order or GPU."""
+    print("🧪 Testing training fingerprint...")
+    config = make_config("fp_lora")
+    first, second = make_dataset(), make_dataset()
+
+    def fingerprint(cfg, folder, options=None):
+        cfg = yaml.safe_load(yaml.dump(cfg))
+        cfg["config"]["process"][0]["datasets"][0]["folder_path"] = folder
+        return training_fingerprint(cfg, options)
+
+    base = fingerprint(config, first)
+    assert fingerprint(config, second) == base  # New upload folder, same photos
+
+    reordered = {"config": dict(reversed(list(config["config"].items()))), "job": "extension"}
+    moved = yaml.safe_load(yaml.dump(config))
+    moved["config"]["process"][0].update(device="cuda:1", training_folder="/elsewhere")
+    moved["meta"] = {"name": "[name]", "version": "1.0"}
+    assert fingerprint(reordered, first) == base and fingerprint(moved, first) == base
+
+    assert fingerprint(make_config("fp_lora", steps=200), first) != base
+    assert fingerprint(config, first, {"early_stopping": {"patience": 5}}) != base
+    with open(os.path.join(second, "img_1.txt"), "w") as f:
+        f.write("photo of sks, indoors")
+    assert fingerprint(config, second) is None  # Changed file not hashed yet: queued, not hashed inline
+    assert FILE_HASHES.wait_idle()
+    assert fingerprint(config, second) not in (None, base)
+
+    pack_dataset_folder(first, remove_loose=True)
+    assert fingerprint(config, first) == base  # Packed dataset, same content
+
+    # The default dataset_path (whole training_data root) or a worker folder is never memoized
+    assert fingerprint(config, TRAINING_DATA_ROOT) is None
+    assert fingerprint(config, os.path.dirname(first)) is None
+    with NoTraining() as runs:
+        unmemoized = [submit(config, TRAINING_DATA_ROOT) for _ in range(2)]
+        assert [r["memoized"] for r in unmemoized] == [None, None] and len(runs.launched) == 2
+        assert unmemoized[0]["training_fingerprint"] is None
+    print(f"   ✅ {base[:12]} stable across folders, key order, device and packing; root not memoized")
+    return True
+
+def test_attach_to_in_flight():
+    """A resubmission attaches to the identical run; force and other configs start new ones."""
+    print("\n🧪 Testing attach to in-flight runs...")
+    config, dataset = make_config(), make_dataset()
+    with NoTraining() as runs:
+        first = submit(config, dataset)
+        assert first["status"] == "success" and first["memoized"] is None and runs.launched == [first["process_id"]]
+        assert get_process(first["process_id"])["training_fingerprint"] == first["training_fingerprint"]
+
+        again = submit(config, make_dataset())  # Dashboard refresh re-uploads the same photos
+        assert again["memoized"] == "in_flight" and again["process_id"] == first["process_id"], again
+        assert again["process_status"] == "preparing" and len(runs.launched) == 1
+
+        forced = submit(config, dataset, force=True)
+        assert forced["memoized"] is None and forced["process_id"] != first["process_id"]
+        other = submit(make_config(config["config"]["name"], steps=50), dataset)
+        assert other["memoized"] is None and len(runs.launched) == 3
+
+        # Records persisted by another worker are found too
+        with handler.PROCESS_LOCK:
+            handler.RUNNING_PROCESSES.pop(forced["process_id"])
+        assert submit(config, dataset)["process_id"] == forced["process_id"]
+    print("   ✅ Attached, force started a second run, changed config a third")
+    return True
+
+def test_completed_run_returns_artifacts():
+    """A completed run answers with its artifacts until they are gone; failed runs train again."""
+    print("\n🧪 Testing completed run reuse...")
+    config, dataset = make_config(), make_dataset()
+    with NoTraining() as runs:
+        first = submit(config, dataset)
+        process_id = first["process_id"]
+        run_folder = os.path.join(first["output_dir"], config["config"]["name"])
+        os.makedirs(run_folder)
+        final_path = os.path.join(run_folder, f"{config['config']['name']}.safetensors")
+        with open(final_path, "wb") as f:
+            f.write(b"lora weights")
+        handler.complete_training_process(process_id)
+
+        reused = submit(config, dataset)
+        assert reused["memoized"] == "completed" and reused["process_id"] == process_id, reused
+        assert reused["process_status"] == "completed" and reused["artifacts"]["final"]["path"] == final_path
+        assert len(runs.launched) == 1
+
+        os.remove(final_path)  # e.g. retention GC
+        retrained = submit(config, dataset)
+        assert retrained["memoized"] is None and len(runs.launched) == 2
+
+        update_process_status(retrained["process_id"], "failed", error="CUDA out of memory")
+        after_failure = submit(config, dataset)
+        assert after_failure["memoized"] is None and len(runs.launched) == 3
+    print("   ✅ Artifacts returned, missing artifacts and failures retrained")
+    return True
+
+def test_fresh_claim_counts_as_in_flight():
+    """A claim whose process record is not written yet is in flight for a short grace period only."""
+    print("\n🧪 Testing claim grace period...")
+    fingerprint = uuid.uuid4().hex
+    assert TRAINING_MEMO.claim(fingerprint, "ghost1") is None
+    mode, record = TRAINING_MEMO.claim(fingerprint, "other")
+    assert mode == "in_flight" and record["id"] == "ghost1"
+
+    original = handler.MEMO_CLAIM_GRACE_SECONDS
+    handler.MEMO_CLAIM_GRACE_SECONDS = 0
+    try:
+        assert TRAINING_MEMO.claim(fingerprint, "other") is None
+        assert TRAINING_MEMO.claim(fingerprint, "third", force=True) is None
+    finally:
+        handler.MEMO_CLAIM_GRACE_SECONDS = original
+    print("   ✅ Fresh claim attached, stale claim replaced")
+    return True
+
+def test_failed_launch_releases_claim():
+    """A request that fails before its process exists does not leave a claim behind."""
+    print("\n🧪 Testing claim release on failed launches...")
+    config, dataset = make_config(), make_dataset()
+    original = handler.write_training_config
+    handler.write_training_config = lambda *args: (_ for _ in ()).throw(OSError("disk full"))
+    try:
+        failed = submit(config, dataset)
+    finally:
+        handler.write_training_config = original
+    assert failed["status"] == "error" and "disk full" in failed["error"], failed
+    with NoTraining() as runs:
+        retry = submit(config, dataset)
+        assert retry["status"] == "success" and retry["memoized"] is None and len(runs.launched) == 1, retry
+    print("   ✅ Retry after a failed launch starts the run")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL TRAINING MEMO TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_fingerprint_normalization,
+        test_attach_to_in_flight,
+        test_completed_run_returns_artifacts,
+        test_fresh_claim_counts_as_in_flight,
+        test_failed_launch_releases_claim,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR TRAINING PREPARATION
+Tests the asynchronous preparation phase locally with fake (gated) setup functions
+
+This tests:
+- train returns immediately with the process in 'preparing'
+- Stage progress and errors in process_status / health
+- Concurrent requests share one toolkit setup / model download
+- Model path injected and training started once stages are ready
+- Failed stages fail the process and are retried by the next request
+- Cross-worker single-flight provisioning (fcntl lock + lease, staging dir, atomic rename)
+- Trained LoRAs under ai-toolkit/output survive (re)provisioning; foreign final paths are never replaced
+"""
+
+import sys
+import os
+import json
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_prepare_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import handler
+from handler import (
+    ProvisioningStage, PROVISIONING_STAGES, handle_train_lora, handle_train_with_yaml,
+    handle_process_status, handle_provision, get_process, single_flight_provision, VolumeLease, ai_toolkit_ready
+)
+
+CONFIG = {
+    "job": "extension",
+    "config": {
+        "name": "prep_lora",
+        "process": [{"type": "sd_trainer", "model": {"name_or_path": "black-forest-labs/FLUX.1-dev"},
+                     "train": {"steps": 100}}]
+    }
+}
+
+class FakeSetup:
+    """Setup function that blocks until released and counts its calls."""
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(10)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+class FakeStages:
+    """Swap the provisioning stages and the training runner for the duration of a test."""
+
+    def __init__(self, toolkit, model):
+        self.toolkit, self.model = toolkit, model
+        self.started = []
+
+    def __enter__(self):
+        self.saved = dict(PROVISIONING_STAGES), handler.run_training_in_background
+        PROVISIONING_STAGES["ai_toolkit"] = ProvisioningStage("ai_toolkit", self.toolkit)
+        PROVISIONING_STAGES["flux_model"] = ProvisioningStage("flux_model", self.model,
+                                                              lambda: {"downloaded_bytes": 123})
+        handler.run_training_in_background = lambda *args: self.started.append(args)
+        return self
+
+    def __exit__(self, *exc):
+        self.toolkit.release.set()
+        self.model.release.set()
+        PROVISIONING_STAGES.clear()
+        PROVISIONING_STAGES.update(self.saved[0])
+        handler.run_training_in_background = self.saved[1]
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def test_train_returns_while_preparing():
+    """train is registered as 'preparing' and returns before setup finishes."""
+    print("🧪 Testing non-blocking train request...")
+    with FakeStages(FakeSetup(True), FakeSetup("/models/FLUX.1-dev")) as fake:
+        start = time.time()
+        result = handle_train_lora({"config": CONFIG})
+        assert result["status"] == "success" and time.time() - start < 1, result
+        assert result["process_status"] == "preparing"
+
+        status = handle_process_status({"process_id": result["process_id"]})["process"]
+        assert status["status"] == "preparing"
+        assert wait_for(lambda: fake.toolkit.calls and fake.model.calls)  # Both stages run in parallel
+        preparation = handle_process_status({"process_id": result["process_id"]})["process"]["preparation"]
+        assert preparation["flux_model"]["state"] == "running" and preparation["flux_model"]["downloaded_bytes"] == 123
+        assert handler.handler({"input": {"type": "health"}})["provisioning"]["ai_toolkit"]["state"] == "running"
+
+        fake.toolkit.release.set()
+        fake.model.release.set()
+        assert wait_for(lambda: fake.started)
+        process_id, config_path = fake.started[0][:2]
+        assert process_id == result["process_id"] and get_process(process_id)["status"] == "pending"
+        with open(config_path) as f:
+            assert "/models/FLUX.1-dev" in f.read()
+        assert get_process(process_id)["preparation"]["flux_model"]["state"] == "ready"
+    print(f"   ✅ Returned in {time.time() - start:.2f}s, training started after preparation")
+    return True
+
+def test_concurrent_requests_share_stages():
+    """Retries / parallel requests wait on the same setup instead of repeating it."""
+    print("\n🧪 Testing shared provisioning stages...")
+    with FakeStages(FakeSetup(True), FakeSetup("/models/FLUX.1-dev")) as fake:
+        first = handle_train_lora({"config": CONFIG})
+        second = handle_train_lora({"config": CONFIG})
+        yaml_run = handle_train_with_yaml({"yaml_config": CONFIG})
+        assert all(r["status"] == "success" for r in (first, second, yaml_run))
+        fake.toolkit.release.set()
+        fake.model.release.set()
+        assert wait_for(lambda: len(fake.started) == 3)
+        assert fake.toolkit.calls == 1 and fake.model.calls == 1
+
+        # Already provisioned stages are not run again
+        handle_train_lora({"config": CONFIG})
+        assert wait_for(lambda: len(fake.started) == 4) and fake.model.calls == 1
+    print("   ✅ 4 runs, 1 toolkit setup, 1 model download")
+    return True
+
+def test_failed_stage_fails_process_and_retries():
+    """A failed stage fails its waiting processes with the stage error; the next request retries it."""
+    print("\n🧪 Testing stage failure and retry...")
+    model = FakeSetup(RuntimeError("disk full"))
+    model.release.set()
+    toolkit = FakeSetup(True)
+    toolkit.release.set()
+    with FakeStages(toolkit, model) as fake:
+        result = handle_train_lora({"config": CONFIG})
+        assert wait_for(lambda: get_process(result["process_id"])["status"] == "failed")
+        process = get_process(result["process_id"])
+        assert "flux_model failed: disk full" in process["error"] and not fake.started
+        assert process["preparation"]["flux_model"]["state"] == "failed"
+
+        model.result = "/models/FLUX.1-dev"
+        retry = handle_train_lora({"config": CONFIG})
+        assert wait_for(lambda: fake.started) and fake.started[0][0] == retry["process_id"]
+        assert model.calls == 2 and toolkit.calls == 1
+
+        # Killed while preparing -> training never starts
+        model.result, model.release = "/models/FLUX.1-dev", threading.Event()
+        PROVISIONING_STAGES["flux_model"].state = "idle"
+        killed = handle_train_lora({"config": CONFIG})
+        handler.force_kill_process(killed["process_id"], "test")
+        model.release.set()
+        time.sleep(0.2)
+        assert len(fake.started) == 1
+
+    assert handle_provision({"stages": ["nope"]})["status"] == "error"
+    print("   ✅ Stage error reported, retried by the next request")
+    return True
+
+WORKER_SCRIPT = """
+import os, sys, time
+sys.path.insert(0, sys.argv[1])
+import handler
+final_path = sys.argv[2]
+
+def build(staging_path, lease):
+    os.makedirs(staging_path, exist_ok=True)
+    with open(final_path + ".builds", "a") as f:
+        f.write(f"{os.getpid()}\\n")
+    time.sleep(0.5)
+    with open(os.path.join(staging_path, "run.py"), "w") as f:
+        f.write("ok")
+    return True
+
+ok = handler.single_flight_provision(sys.argv[3], final_path, handler.ai_toolkit_ready, build,
+                                     timeout=30, poll_seconds=0.05)
+print("READY" if ok and handler.ai_toolkit_ready(final_path) else "FAILED")
+"""
+
+def test_single_flight_across_workers():
+    """Workers starting together: one builds into the staging dir, the others wait for the rename."""
+    print("\n🧪 Testing cross-worker single-flight provisioning...")
+    final_path = os.path.join(tempfile.mkdtemp(), "ai-toolkit")
+    name = f"test_{uuid.uuid4().hex[:6]}"
+    env = {**os.environ, "WORKSPACE_PATH": handler.WORKSPACE_PATH}
+    workers = [
+        subprocess.Popen([sys.executable, "-c", WORKER_SCRIPT, os.path.dirname(os.path.abspath(__file__)),
+                          final_path, name], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=env)
+        for _ in range(3)
+    ]
+    outputs = [worker.communicate(timeout=60)[0] for worker in workers]
+    assert all(output.strip().endswith("READY") for output in outputs), outputs
+    with open(final_path + ".builds") as f:
+        assert len(f.read().split()) == 1  # Exactly one worker built it
+    assert ai_toolkit_ready(final_path) and handler.staging_dirs(final_path) == []
+    assert VolumeLease(name).read_lease() is None  # Released cleanly
+    print("   ✅ 3 workers, 1 build, atomic publish")
+    return True
+
+def make_quiet(path, age=3600):
+    """Backdate a tree as if its writer stopped long ago."""
+    old = time.time() - age
+    for root, _, files in os.walk(path):
+        for name in files + [""]:
+            os.utime(os.path.join(root, name), (old, old))
+
+def test_crash_recovery_resumes_staging():
+    """An expired lease of a crashed holder is taken over and its staging dir is continued."""
+    print("\n🧪 Testing crash recovery from the staging dir...")
+    final_path = os.path.join(tempfile.mkdtemp(), "ai-toolkit")
+    name = f"test_{uuid.uuid4().hex[:6]}"
+    crashed_staging = final_path + ".staging-dead-worker-1"
+    os.makedirs(crashed_staging)
+    with open(os.path.join(crashed_staging, "partial.bin"), "w") as f:
+        f.write("half")
+    make_quiet(crashed_staging)
+    os.makedirs(handler.LOCK_DIR, exist_ok=True)
+    with open(VolumeLease(name).path, "w") as f:
+        json.dump({"owner": "dead-worker-1", "worker": "dead", "expires_at": time.time() - 1}, f)
+
+    seen = []
+
+    def build(staging_path, lease):
+        assert staging_path.endswith(f".staging-{lease.owner}")
+        seen.append(sorted(os.listdir(staging_path)))
+        with open(os.path.join(staging_path, "run.py"), "w") as f:
+            f.write("ok")
+        return True
+
+    assert single_flight_provision(name, final_path, ai_toolkit_ready, build, timeout=5, poll_seconds=0.05)
+    assert seen == [["partial.bin"]]
+    assert sorted(os.listdir(final_path)) == [handler.PROVISION_MARKER_FILENAME, "partial.bin", "run.py"]
+    assert handler.staging_dirs(final_path) == []
+
+    # A final path provisioning did not publish is neither adopted nor replaced
+    other_path = os.path.join(tempfile.mkdtemp(), "ai-toolkit")
+    os.makedirs(other_path)
+    open(os.path.join(other_path, "partial.bin"), "w").close()
+    make_quiet(other_path)
+    seen.clear()
+    assert not single_flight_provision(f"{name}_2", other_path, ai_toolkit_ready, build, timeout=5, poll_seconds=0.05)
+    assert seen == [] and os.listdir(other_path) == ["partial.bin"]
+
+    # A failed build publishes nothing
+    failed_path = os.path.join(tempfile.mkdtemp(), "ai-toolkit")
+    assert not single_flight_provision(f"{name}_3", failed_path, ai_toolkit_ready, lambda staging, lease: False,
+                                       timeout=5, poll_seconds=0.05)
+    assert not os.path.exists(failed_path)
+    print("   ✅ Expired lease taken over, partial staging continued")
+    return True
+
+def test_lost_lease_holder_keeps_its_own_staging():
+    """A staging dir still being written by a holder that lost its lease is not taken over."""
+    print("\n🧪 Testing staging isolation after a lost lease...")
+    final_path = os.path.join(tempfile.mkdtemp(), "FLUX.1-dev")
+    live_staging = final_path + ".staging-slow-worker-1"  # Written a moment ago
+    os.makedirs(live_staging)
+    with open(os.path.join(live_staging, "shard.safetensors.incomplete"), "wb") as f:
+        f.write(b"x" * 100)
+
+    def build(staging_path, lease):
+        assert staging_path != live_staging and not os.path.exists(staging_path)  # Nothing adopted
+        os.makedirs(staging_path, exist_ok=True)
+        with open(os.path.join(staging_path, "run.py"), "w") as f:
+            f.write("ok")
+        return True
+
+    name = f"test_{uuid.uuid4().hex[:6]}"
+    assert single_flight_provision(name, final_path, ai_toolkit_ready, build, timeout=5, poll_seconds=0.05)
+    assert sorted(os.listdir(final_path)) == [handler.PROVISION_MARKER_FILENAME, "run.py"]
+    assert os.path.exists(live_staging)
+
+    # The old holder's download stops once it sees the lease is lost
+    stopped = handler.RepoDownload("org/repo", {"a": 10}, should_stop=lambda: True)
+    try:
+        handler.download_hf_file("http://127.0.0.1:9/a", os.path.join(live_staging, "a"), 10, None, stopped)
+    except RuntimeError as e:
+        assert "stopped" in str(e)
+    else:
+        raise AssertionError("download continued after the lease was lost")
+    print("   ✅ Fresh foreign staging left alone, lost holder stops downloading")
+    return True
+
+def test_provisioning_keeps_training_output():
+    """A toolkit dir holding only output/ (run.py missing) is provisioned without losing the LoRAs."""
+    print("\n🧪 Testing that provisioning keeps ai-toolkit/output...")
+    final_path = os.path.join(tempfile.mkdtemp(), "ai-toolkit")
+    lora_path = os.path.join(final_path, "output", "my_lora", "x.safetensors")
+    os.makedirs(os.path.dirname(lora_path))
+    with open(lora_path, "wb") as f:
+        f.write(b"weights")
+    make_quiet(final_path)
+    clones = []
+
+    def fake_clone(cmd, **kwargs):
+        clones.append(cmd[-1])
+        os.makedirs(os.path.join(cmd[-1], "output"))  # The checkout ships an empty output/ too
+        with open(os.path.join(cmd[-1], "run.py"), "w") as f:
+            f.write("ok")
+        return subprocess.CompletedProcess(cmd, 0, "", "")
+
+    original_run = handler.subprocess.run
+    handler.subprocess.run = fake_clone
+    try:
+        for attempt in range(2):  # First publish, then a re-provision of our own (marked) tree
+            if attempt:
+                os.remove(os.path.join(final_path, "run.py"))
+            assert single_flight_provision(f"test_{uuid.uuid4().hex[:6]}", final_path, ai_toolkit_ready,
+                                           handler.fetch_ai_toolkit, timeout=5, poll_seconds=0.05,
+                                           preserve=handler.AI_TOOLKIT_PRESERVE)
+            assert ai_toolkit_ready(final_path)
+            with open(lora_path, "rb") as f:
+                assert f.read() == b"weights"
+    finally:
+        handler.subprocess.run = original_run
+    assert len(clones) == 2 and not any(os.path.exists(path) for path in clones)  # Clone dirs cleaned up
+    assert handler.staging_dirs(final_path) == []
+    assert not [name for name in os.listdir(os.path.dirname(final_path)) if name != "ai-toolkit"]
+    print("   ✅ output/ carried into the published tree, nothing else left behind")
+    return True
+
+def test_lease_renewal_and_expiry():
+    """Held leases are renewed; foreign live leases block; a stolen lease is detected."""
+    print("\n🧪 Testing lease renewal and expiry...")
+    name = f"test_{uuid.uuid4().hex[:6]}"
+    holder = VolumeLease(name, lease_seconds=0.3, renew_seconds=0.1)
+    assert holder.try_acquire()
+    assert not VolumeLease(name).try_acquire()  # flock held
+    time.sleep(0.5)
+    lease = holder.read_lease()
+    assert lease["owner"] == holder.owner and lease["expires_at"] > time.time()
+    holder.release()
+
+    # Filesystems without shared flock: the lease alone keeps others out until it expires
+    with open(holder.path, "w") as f:
+        json.dump({"owner": "other-host", "worker": "other", "expires_at": time.time() + 0.3}, f)
+    contender = VolumeLease(name, renew_seconds=0.05)
+    assert not contender.try_acquire()
+    time.sleep(0.4)
+    assert contender.try_acquire()
+
+    # Another worker took over (we were too slow to renew): the holder notices
+    with open(contender.path, "w") as f:
+        json.dump({"owner": "thief", "worker": "thief", "expires_at": time.time() + 60}, f)
+    assert wait_for(lambda: contender.lost)
+    contender.release()
+    assert VolumeLease(name).read_lease()["owner"] == "thief"  # A lost lease is not cleared
+    print("   ✅ Renewed while held, foreign lease respected, takeover detected")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL TRAINING PREPARATION TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_train_returns_while_preparing,
+        test_concurrent_requests_share_stages,
+        test_failed_stage_fails_process_and_retries,
+        test_single_flight_across_workers,
+        test_crash_recovery_resumes_staging,
+        test_lost_lease_holder_keeps_its_own_staging,
+        test_provisioning_keeps_training_output,
+        test_lease_renewal_and_expiry,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
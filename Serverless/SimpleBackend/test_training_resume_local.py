@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR TRAINING RESUME
+Tests checkpoint discovery and resume locally with fake checkpoint files
+
+This tests:
+- Latest save_every checkpoint discovery in a process output folder
+- Config rewrite (pretrained_lora_path, remaining steps, new run name)
+- resume job type from a persisted record (worker loss), refused while the record is fresh
+- Automatic resume after a crashed attempt (fake ai-toolkit run.py)
+"""
+
+import sys
+import os
+import json
+import stat
+import tempfile
+import time
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_resume_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import handler
+from handler import (
+    add_process, update_process_status, get_process, find_latest_checkpoint, prepare_resume,
+    handle_resume_training, load_persisted_process, RUNNING_PROCESSES, PROCESS_LOCK
+)
+
+def make_config(training_folder, name="my_lora", steps=1000):
+    return {
+        "job": "extension",
+        "config": {
+            "name": name,
+            "process": [{
+                "type": "sd_trainer",
+                "training_folder": training_folder,
+                "network": {"type": "lora", "linear": 16},
+                "save": {"save_every": 250},
+                "train": {"steps": steps}
+            }]
+        }
+    }
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"fake")
+
+def test_find_latest_checkpoint():
+    """Highest {name}_{step:09d}.safetensors wins; final LoRAs like matt_2.safetensors and other files are ignored."""
+    print("🧪 Testing checkpoint discovery...")
+    folder = os.path.join(tempfile.mkdtemp(), "my_lora")
+    for name in ["my_lora_000000250.safetensors", "my_lora_000000500.safetensors",
+                 "my_lora.safetensors", "optimizer.pt", "samples/x_000000900.jpg",
+                 "my_lora_2.safetensors", "other_000000900.safetensors", "my_lora_v2_000000900.safetensors"]:
+        touch(os.path.join(folder, name))
+
+    latest = find_latest_checkpoint(folder)
+    assert latest["step"] == 500 and latest["path"].endswith("my_lora_000000500.safetensors"), latest
+    assert find_latest_checkpoint(os.path.join(folder, "missing")) is None
+    assert handler.checkpoint_step("matt_2.safetensors", "matt") is None
+    assert handler.checkpoint_step("matt_2_000001000.safetensors", "matt_2") == 1000
+    print("   ✅ Latest checkpoint: step 500")
+    return True
+
+def test_prepare_resume_chain():
+    """Resume plans continue with the remaining steps, also for already resumed runs."""
+    print("\n🧪 Testing resume config rewrite...")
+    training_folder = tempfile.mkdtemp()
+    touch(os.path.join(training_folder, "my_lora", "my_lora_000000250.safetensors"))
+    touch(os.path.join(training_folder, "my_lora", "my_lora_000000500.safetensors"))
+
+    plan = prepare_resume({"config": make_config(training_folder)})
+    process_config = plan["config"]["config"]["process"][0]
+    assert plan["step_offset"] == 500 and plan["resume_count"] == 1
+    assert plan["config"]["config"]["name"] == "my_lora_resume1"
+    assert process_config["train"]["steps"] == 500
+    assert process_config["network"]["pretrained_lora_path"].endswith("my_lora_000000500.safetensors")
+
+    # The resumed run saved once more (its step 200 = absolute step 700)
+    touch(os.path.join(training_folder, "my_lora_resume1", "my_lora_resume1_000000200.safetensors"))
+    second = prepare_resume({**plan, "config": plan["config"]})
+    assert second["step_offset"] == 700 and second["config"]["config"]["name"] == "my_lora_resume2"
+    assert second["config"]["config"]["process"][0]["train"]["steps"] == 300
+
+    # Nothing saved yet -> nothing to resume
+    assert prepare_resume({"config": make_config(tempfile.mkdtemp())}) is None
+    print("   ✅ 500 -> 700, remaining 500 -> 300")
+    return True
+
+def test_resume_job_after_worker_loss():
+    """resume job type works from the persisted record when the process is not in memory."""
+    print("\n🧪 Testing resume job type after worker loss...")
+    training_folder = tempfile.mkdtemp()
+    touch(os.path.join(training_folder, "my_lora", "my_lora_000000250.safetensors"))
+    add_process("lost01", "train_yaml", "running", make_config(training_folder))
+    with PROCESS_LOCK:
+        del RUNNING_PROCESSES["lost01"]  # Worker recycled, only the volume copy is left
+
+    started = []
+    original = handler.run_training_in_background
+    handler.run_training_in_background = lambda *args: started.append(args)
+    try:
+        # A fresh 'running' record may belong to a worker that is still training it
+        refused = handle_resume_training({"process_id": "lost01"})
+        assert refused["status"] == "error" and "another worker" in refused["error"], refused
+        result = handle_resume_training({"process_id": "lost01", "force": True})
+
+        # Without force, a record nobody updated for longer than a run can last is resumable
+        stale = dict(load_persisted_process("lost01"), updated_at="2000-01-01T00:00:00")
+        with open(os.path.join(handler.PROCESS_STATE_DIR, "lost02.json"), "w") as f:
+            json.dump(stale, f)
+        assert handle_resume_training({"process_id": "lost02"})["status"] == "success"
+    finally:
+        handler.run_training_in_background = original
+    time.sleep(0.1)
+
+    assert result["status"] == "success", result
+    assert result["resume_step"] == 250 and result["remaining_steps"] == 750
+    new_process = get_process(result["process_id"])
+    assert new_process["resume_of"] == "lost01" and new_process["step_offset"] == 250
+    assert len(started) == 2 and started[0][0] == result["process_id"]
+
+    update_process_status(result["process_id"], "running")
+    busy = handle_resume_training({"process_id": result["process_id"]})
+    assert busy["status"] == "error"
+    print(f"   ✅ Resumed as {result['process_id']} from step 250")
+    return True
+
+FAKE_RUN_PY = '''
+import sys, os, yaml
+config = yaml.safe_load(open(sys.argv[1]))
+name = config["config"]["name"]
+process = config["config"]["process"][0]
+steps = process["train"]["steps"]
+folder = os.path.join(process["training_folder"], name)
+os.makedirs(folder, exist_ok=True)
+if "pretrained_lora_path" not in process["network"]:
+    for step in (250, 500):
+        print(f"lora: |#| {step}/{steps} [00:01<00:10,  5.0it/s, lr: 1e-04 loss: 0.5]", flush=True)
+        open(os.path.join(folder, f"{name}_{step:09d}.safetensors"), "wb").write(b"fake")
+    sys.exit(1)  # Crash after step 500
+print(f"lora: |#| {steps}/{steps} [00:10<00:00,  5.0it/s, lr: 1e-04 loss: 0.3]", flush=True)
+open(os.path.join(folder, f"{name}.safetensors"), "wb").write(b"fake")
+'''
+
+def test_auto_resume_after_crash():
+    """With auto_resume the same process continues from step 500 and completes."""
+    print("\n🧪 Testing automatic resume after a crash...")
+    bin_dir = tempfile.mkdtemp()
+    fake_cli = os.path.join(bin_dir, "huggingface-cli")
+    with open(fake_cli, "w") as f:
+        f.write("#!/bin/sh\nexit 0\n")
+    os.chmod(fake_cli, os.stat(fake_cli).st_mode | stat.S_IEXEC)
+    fake_run = os.path.join(bin_dir, "run.py")
+    with open(fake_run, "w") as f:
+        f.write(FAKE_RUN_PY)
+
+    training_folder = tempfile.mkdtemp()
+    config_path = handler.write_training_config(make_config(training_folder), "auto01")
+    add_process("auto01", "train_yaml", "pending", make_config(training_folder))
+
+    original_path, original_cmd = os.environ["PATH"], handler.TRAINING_COMMAND
+    os.environ["PATH"] = bin_dir + os.pathsep + original_path
+    handler.TRAINING_COMMAND = [sys.executable, fake_run]
+    try:
+        handler.run_training_in_background("auto01", config_path, None, 1)
+    finally:
+        os.environ["PATH"], handler.TRAINING_COMMAND = original_path, original_cmd
+
+    process = get_process("auto01")
+    assert process["status"] == "completed", process.get("error")
+    assert process["resume_count"] == 1 and process["step_offset"] == 500
+    assert process["step"] == 1000 and process["total_steps"] == 1000
+    assert os.path.exists(os.path.join(training_folder, "my_lora_resume1", "my_lora_resume1.safetensors"))
+    print("   ✅ Crashed at 500, resumed and completed 1000 steps")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL TRAINING RESUME TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_find_latest_checkpoint,
+        test_prepare_resume_chain,
+        test_resume_job_after_worker_loss,
+        test_auto_resume_after_crash,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
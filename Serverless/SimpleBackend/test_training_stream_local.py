@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR TRAINING OUTPUT STREAMING
+Tests the training subprocess streaming locally without RunPod or a GPU
+
+This tests:
+- Popen streaming into the per-process ring buffer
+- Rotating per-process log file (sized in bytes)
+- Offset-based log tail reads (process_logs job type)
+- Progress parsing (step, loss, it/s, ETA, last checkpoint)
+- Compact metrics series and downsampling (process_metrics job type)
+- Finished processes: log ring shrunk, oldest logs / metrics dropped from memory
+- Loss-plateau early stopping with graceful SIGINT stop
+- An early-stopped run only completes if it saved a LoRA at or after the stop
+"""
+
+import sys
+import os
+import tempfile
+import time
+import json
+import uuid
+import math
+
+# Keep logs and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_stream_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import handler
+from handler import (
+    ProcessLogBuffer, RotatingLogFile, add_process, run_streaming_subprocess,
+    get_process_log, handle_process_logs, TrainingProgressParser, make_progress_line_handler,
+    create_process_metrics, handle_process_metrics,
+    EarlyStoppingController, parse_early_stopping_settings
+)
+
+# Unique id so a log file left in a shared WORKSPACE_PATH is never appended to
+STREAM_PROCESS_ID = f"stream_{uuid.uuid4().hex[:8]}"
+
+FAKE_TRAINER = (
+    "import sys\n"
+    "for i in range(50):\n"
+    "    print(f'line {i}')\n"
+    "sys.stderr.write('boom\\n')\n"
+    "sys.exit(3)\n"
+)
+
+def test_streaming_subprocess():
+    """Fake trainer output lands in the ring buffer and the log file."""
+    print("🧪 Testing streaming subprocess...")
+    process_id = STREAM_PROCESS_ID
+    add_process(process_id, "train", "running", {})
+
+    returncode = run_streaming_subprocess(process_id, [sys.executable, "-c", FAKE_TRAINER], os.environ.copy(), 30)
+    log = get_process_log(process_id)
+
+    assert returncode == 3, f"unexpected exit code {returncode}"
+    assert log.tail_text("stderr") == "boom"
+    assert log.tail_text("stdout", 1) == "line 49"
+    with open(log.log_file_path, encoding="utf-8") as f:
+        assert len(f.read().splitlines()) == 51
+    assert handler.get_process(process_id)["log_file"] == log.log_file_path
+    print(f"   ✅ 51 lines streamed to {log.log_file_path}")
+    return True
+
+def test_ring_buffer_offsets():
+    """Ring buffer stays bounded and offset reads report truncation."""
+    print("\n🧪 Testing ring buffer offsets...")
+    log = ProcessLogBuffer("ring01", max_lines=10, log_dir=tempfile.mkdtemp())
+    for i in range(25):
+        log.append("stdout", f"line {i}")
+
+    page = log.read(offset=0, limit=4)
+    assert page["truncated"] and page["offset"] == 15
+    assert [l["line"] for l in page["lines"]] == ["line 15", "line 16", "line 17", "line 18"]
+    assert page["next_offset"] == 19
+
+    tail = log.read(offset=None, limit=3)
+    assert [l["seq"] for l in tail["lines"]] == [22, 23, 24]
+
+    done = log.read(offset=25, limit=10)
+    assert done["lines"] == [] and done["next_offset"] == 25
+    print("   ✅ Offsets, tail and truncation OK")
+    return True
+
+def test_log_file_rotation():
+    """Log file rotates to numbered backups once it exceeds max_bytes."""
+    print("\n🧪 Testing log file rotation...")
+    path = os.path.join(tempfile.mkdtemp(), "proc.log")
+    log_file = RotatingLogFile(path, max_bytes=100, backups=2)
+    for i in range(30):
+        log_file.write_line(f"line {i:04d}")
+    log_file.close()
+
+    assert os.path.exists(path + ".1") and os.path.exists(path + ".2")
+    assert not os.path.exists(path + ".3")
+    assert os.path.getsize(path) <= 100
+
+    # Sizes are counted in bytes: 3-byte characters rotate three times as early
+    wide_path = os.path.join(tempfile.mkdtemp(), "wide.log")
+    log_file = RotatingLogFile(wide_path, max_bytes=100, backups=1)
+    for _ in range(6):
+        log_file.write_line("€" * 10)
+    log_file.close()
+    assert os.path.getsize(wide_path) <= 100 and os.path.getsize(wide_path + ".1") <= 100
+    print("   ✅ Rotation keeps 2 bounded backups, multi-byte lines included")
+    return True
+
+def test_process_logs_job():
+    """process_logs job type returns a page and the next offset."""
+    print("\n🧪 Testing process_logs job type...")
+    result = handle_process_logs({"process_id": STREAM_PROCESS_ID, "offset": 10, "limit": 5})
+    assert result["status"] == "success", result
+    assert [l["seq"] for l in result["lines"]] == [10, 11, 12, 13, 14]
+    assert result["next_offset"] == 15
+
+    missing = handle_process_logs({"process_id": "nope"})
+    assert missing["status"] == "error"
+    print("   ✅ process_logs paging OK")
+    return True
+
+def test_progress_parser():
+    """ai-toolkit tqdm and checkpoint lines are parsed into progress fields."""
+    print("\n🧪 Testing progress parser...")
+    parser = TrainingProgressParser(expected_total_steps=1000)
+
+    # Other tqdm bars must not be mistaken for training progress
+    assert not parser.feed("Loading checkpoint shards: 100%|██████████| 3/3 [00:01<00:00,  2.10it/s]")
+    assert not parser.feed("Caching latents to disk: 100%|██████████| 10/10 [00:04<00:00,  2.31it/s]")
+
+    assert parser.feed("my_lora:  12%|█▏        | 120/1000 [02:13<16:17,  1.11s/it, lr: 1.0e-04 loss: 4.123e-01]")
+    state = parser.snapshot()
+    assert state["step"] == 120 and state["total_steps"] == 1000
+    assert abs(state["loss"] - 0.4123) < 1e-9
+    assert abs(state["it_per_sec"] - 0.9009) < 1e-3
+    assert state["eta_seconds"] == 16 * 60 + 17
+
+    assert parser.feed("my_lora:  13%|█▎        | 130/1000 [02:20<1:02:03,  2.50it/s, lr: 1.0e-04 loss: 0.35]")
+    state = parser.snapshot()
+    assert state["it_per_sec"] == 2.5 and state["eta_seconds"] == 3723
+
+    assert parser.feed("Saved to /workspace/output/my_lora/my_lora_000000250.safetensors")
+    assert parser.snapshot()["last_checkpoint"].endswith("my_lora_000000250.safetensors")
+    assert not parser.feed("Generating images")
+    print("   ✅ step/loss/it_per_sec/eta/checkpoint parsed")
+    return True
+
+def test_progress_parser_throughput():
+    """Parsing thousands of lines stays far below a millisecond per line."""
+    print("\n🧪 Testing progress parser throughput...")
+    add_process("prog01", "train", "running", {})
+    handle_line = make_progress_line_handler("prog01", TrainingProgressParser(20000))
+    lines = [
+        f"my_lora:  {i // 200}%|▏| {i}/20000 [02:13<16:17,  1.11s/it, lr: 1.0e-04 loss: {0.5 - i / 1e5:.4e}]"
+        if i % 3 else f"noise line without progress {i}"
+        for i in range(20000)
+    ]
+
+    start = time.perf_counter()
+    for line in lines:
+        handle_line("stderr", line)
+    per_line_us = (time.perf_counter() - start) / len(lines) * 1e6
+
+    record = handler.get_process("prog01")
+    assert record["step"] is not None and record["loss"] is not None
+    assert per_line_us < 100, f"{per_line_us:.1f}us per line"
+    print(f"   ✅ {per_line_us:.1f}us per line")
+    return True
+
+def test_process_metrics():
+    """A 20k-step run costs kilobytes of memory and response size."""
+    print("\n🧪 Testing process metrics series...")
+    add_process("metrics01", "train", "running", {})
+    metrics = create_process_metrics("metrics01")
+    for step in range(20000):
+        loss = 0.5 * math.exp(-step / 5000) + 0.01 * math.sin(step)
+        metrics.append(step, 5.0 if step == 12345 else loss, 1.1)
+
+    assert metrics.raw_points == 20000
+    assert metrics.memory_bytes() < 64 * 1024, metrics.memory_bytes()
+
+    for method in ("lttb", "minmax"):
+        result = handle_process_metrics({"process_id": "metrics01", "points": 300, "method": method})
+        assert result["status"] == "success", result
+        series = result["series"]
+        assert series["points"] <= 300
+        assert series["step"][0] == 0 and series["step"][-1] == 19999
+        assert series["step"] == sorted(series["step"])
+        assert max(series["loss"]) == 5.0, f"{method} dropped the loss spike"
+        assert len(json.dumps(result)) < 16 * 1024
+
+    bad = handle_process_metrics({"process_id": "metrics01", "method": "fft"})
+    assert bad["status"] == "error"
+    print(f"   ✅ {metrics.memory_bytes()} bytes stored for 20000 steps")
+    return True
+
+def test_finished_process_buffers():
+    """Finished processes keep a short log tail; beyond the limit their logs and metrics are dropped."""
+    print("\n🧪 Testing buffers of finished processes...")
+    original = handler.FINISHED_PROCESS_BUFFERS_KEPT
+    handler.FINISHED_PROCESS_BUFFERS_KEPT = 2
+    try:
+        ids = [f"done_{uuid.uuid4().hex[:6]}" for _ in range(3)]
+        for process_id in ids:
+            add_process(process_id, "train", "running", {})
+            log = handler.create_process_log(process_id)
+            for i in range(handler.LOG_FINISHED_RING_LINES + 50):
+                log.append("stdout", f"line {i}")
+            create_process_metrics(process_id).append(1, 0.5)
+        running = get_process_log(ids[0])
+        handler.update_process_status(ids[0], "running")
+        assert running.log_file and len(running.lines) == handler.LOG_FINISHED_RING_LINES + 50
+
+        for process_id in ids:
+            handler.update_process_status(process_id, "completed")
+        assert get_process_log(ids[0]) is None and handler.get_process_metrics(ids[0]) is None
+        assert running.log_file is None
+        kept = get_process_log(ids[2])
+        assert kept.log_file is None and len(kept.lines) == handler.LOG_FINISHED_RING_LINES
+        assert handler.get_process_metrics(ids[2]) is not None
+        with open(kept.log_file_path, encoding="utf-8") as f:
+            assert len(f.read().splitlines()) == handler.LOG_FINISHED_RING_LINES + 50  # The file keeps everything
+
+        kept.reopen()  # Resumed attempt: full ring again
+        assert kept.lines.maxlen == handler.LOG_RING_LINES and kept.log_file
+        kept.close()
+    finally:
+        handler.FINISHED_PROCESS_BUFFERS_KEPT = original
+    print("   ✅ Oldest finished process dropped, tail and log file kept for the others")
+    return True
+
+PLATEAU_TRAINER = (
+    "import sys, time\n"
+    "try:\n"
+    "    for step in range(1, 5001):\n"
+    "        loss = max(0.2, 1.0 - step / 100)\n"
+    "        print(f'lora: |#| {step}/5000 [00:01<10:00,  50.0it/s, lr: 1e-04 loss: {loss:.4f}]', flush=True)\n"
+    "        time.sleep(0.001)\n"
+    "except KeyboardInterrupt:\n"
+    "    print('Saved to /tmp/out/lora_interrupted.safetensors', flush=True)\n"
+    "    sys.exit(130)\n"
+)
+
+def test_early_stopping_controller():
+    """EMA/patience rule only fires after warmup and a real plateau."""
+    print("\n🧪 Testing early stopping controller...")
+    assert not EarlyStoppingController().enabled
+    assert parse_early_stopping_settings(True)["enabled"]
+    try:
+        parse_early_stopping_settings({"patience": 10})
+        assert False, "unknown option accepted"
+    except ValueError:
+        pass
+
+    stopper = EarlyStoppingController({"enabled": True, "ema_alpha": 0.5, "patience_steps": 50, "min_steps": 100})
+    fired = [step for step in range(1, 1001) if stopper.observe(step, max(0.3, 1.0 - step / 200), 1000)]
+    # Loss flattens at step 140, EMA stops improving by 0.5% shortly after
+    assert len(fired) == 1 and 150 < fired[0] < 260, fired
+
+    summary = stopper.summary(it_per_sec=2.0)
+    assert summary["steps_saved"] == 1000 - fired[0]
+    assert summary["gpu_minutes_saved"] == round((1000 - fired[0]) / 2.0 / 60, 1)
+    print(f"   ✅ Stopped at step {fired[0]}, saved {summary['steps_saved']} steps")
+    return True
+
+def test_early_stopping_graceful_stop():
+    """A plateaued fake trainer gets SIGINT, saves and exits well before its last step."""
+    print("\n🧪 Testing graceful early stop of a subprocess...")
+    process_id = "early01"
+    add_process(process_id, "train", "running", {})
+    parser = TrainingProgressParser(5000)
+    stopper = EarlyStoppingController({"enabled": True, "ema_alpha": 0.5, "patience_steps": 50, "min_steps": 100})
+    handle_line = make_progress_line_handler(process_id, parser, None, stopper)
+
+    returncode = run_streaming_subprocess(process_id, [sys.executable, "-u", "-c", PLATEAU_TRAINER],
+                                          os.environ.copy(), 60, [handle_line])
+
+    record = handler.get_process(process_id)
+    assert stopper.triggered and returncode == 130, returncode
+    assert parser.snapshot()["step"] < 5000
+    assert parser.snapshot()["last_checkpoint"].endswith("lora_interrupted.safetensors")
+    assert record["early_stopping"]["triggered"] and record["early_stopping"]["steps_saved"] > 4000
+    print(f"   ✅ Stopped at step {stopper.stop_step}, ~{record['early_stopping']['gpu_minutes_saved']} GPU-minutes saved")
+    return True
+
+# Like PLATEAU_TRAINER, but on SIGINT saves the final LoRA to argv[1] (if given) before exiting
+STOPPING_TRAINER = PLATEAU_TRAINER.replace(
+    "    print('Saved to /tmp/out/lora_interrupted.safetensors', flush=True)\n",
+    "    if sys.argv[1]:\n"
+    "        open(sys.argv[1], 'wb').close()\n"
+)
+
+def test_early_stop_requires_saved_lora():
+    """A stopped run that wrote no LoRA after the stop fails (resumable) instead of completing."""
+    print("\n🧪 Testing early-stop completion against the saved LoRA...")
+    training_folder = tempfile.mkdtemp()
+    settings = {"enabled": True, "ema_alpha": 0.5, "patience_steps": 50, "min_steps": 100}
+    original_cmd = handler.TRAINING_COMMAND
+    try:
+        for process_id, saves in (("early02", False), ("early03", True)):
+            config = {"job": "extension", "config": {"name": process_id, "process": [
+                {"type": "sd_trainer", "training_folder": training_folder, "train": {"steps": 5000}}]}}
+            final_lora = os.path.join(training_folder, process_id, f"{process_id}.safetensors")
+            os.makedirs(os.path.dirname(final_lora))
+            add_process(process_id, "train_yaml", "running", config)
+            handler.TRAINING_COMMAND = [sys.executable, "-u", "-c", STOPPING_TRAINER, final_lora if saves else ""]
+            error = handler.run_training_attempt(process_id, "unused.yaml", os.environ.copy(), settings)
+            record = handler.get_process(process_id)
+            assert record["early_stopping"]["triggered"]
+            if saves:
+                assert error is None and record["status"] == "completed", error
+            else:
+                assert "saved no LoRA" in error and record["status"] == "running", error
+    finally:
+        handler.TRAINING_COMMAND = original_cmd
+    print("   ✅ No save after the stop -> error, final LoRA after the stop -> completed")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL TRAINING STREAM TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_streaming_subprocess,
+        test_ring_buffer_offsets,
+        test_log_file_rotation,
+        test_process_logs_job,
+        test_progress_parser,
+        test_progress_parser_throughput,
+        test_process_metrics,
+        test_finished_process_buffers,
+        test_early_stopping_controller,
+        test_early_stopping_graceful_stop,
+        test_early_stop_requires_saved_lora,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+🧪 LOCAL TESTER FOR TRAINING CONFIG TEMPLATES
+Tests train_with_yaml by template id + overrides instead of a full YAML (no GPU needed)
+
+This tests:
+- Overrides are deep-merged into a copy of the template and checked for keys, types and limits
+- Templates on the volume are parsed once, reloaded when changed, rejected when invalid
+- train_with_yaml / list_templates jobs; a template run equals the same config sent as YAML
+- A template's own dataset folder_path is only replaced by an explicit dataset_path
+"""
+
+import sys
+import os
+import json
+import tempfile
+import uuid
+import yaml
+
+# Keep logs, process records and outputs out of /workspace while testing
+os.environ.setdefault("WORKSPACE_PATH", tempfile.mkdtemp(prefix="lora_templates_test_"))
+
+# Add the current directory to Python path to import handler functions
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import handler
+from handler import (
+    render_training_template, TrainingTemplateRegistry, BUILTIN_TRAINING_TEMPLATES, TRAINING_DATA_ROOT
+)
+
+def make_dataset():
+    folder = os.path.join(TRAINING_DATA_ROOT, "worker1", f"tpl_{uuid.uuid4().hex[:8]}")
+    os.makedirs(folder)
+    with open(os.path.join(folder, "img_0.txt"), "w") as f:
+        f.write("photo of sks")
+    handler.FILE_HASHES.get(os.path.join(folder, "img_0.txt"))  # As upload_training_data records it
+    return folder
+
+class NoTraining:
+    """Record launches instead of preparing / training."""
+
+    def __enter__(self):
+        self.launched = []
+        self.original = handler.prepare_training_in_background
+        handler.prepare_training_in_background = lambda process_id, *args: self.launched.append(process_id)
+        return self
+
+    def __exit__(self, *exc):
+        handler.prepare_training_in_background = self.original
+
+def test_render_with_overrides():
+    """Overrides land in the first process; the shared template stays untouched; bad overrides are refused."""
+    print("🧪 Testing template rendering...")
+    before = json.dumps(BUILTIN_TRAINING_TEMPLATES, sort_keys=True)
+    config = render_training_template("training_conservative", {
+        "name": "matt_v2", "trigger_word": "sks",
+        "train": {"steps": 1500, "lr": 0.0002}, "network": {"linear": 32},
+        "datasets": {"caption_dropout_rate": 0.1}, "sample": {"prompts": ["photo of sks"]}
+    })
+    process = config["config"]["process"][0]
+    assert config["config"]["name"] == "matt_v2" and process["trigger_word"] == "sks"
+    assert process["train"]["steps"] == 1500 and process["train"]["optimizer"] == "adamw8bit"
+    assert process["network"] == {"type": "lora", "linear": 32, "linear_alpha": 16}
+    assert process["datasets"][0]["caption_dropout_rate"] == 0.1 and process["datasets"][0]["caption_ext"] == "txt"
+    assert process["sample"]["prompts"] == ["photo of sks"]
+    process["datasets"][0]["folder_path"] = "/elsewhere"  # handle_train_with_yaml rewrites the copy
+    assert json.dumps(BUILTIN_TRAINING_TEMPLATES, sort_keys=True) == before
+    assert render_training_template("training_conservative") == BUILTIN_TRAINING_TEMPLATES["training_conservative"]
+
+    refused = [
+        ({"train": {"stepz": 10}}, "Unknown template setting 'train.stepz'"),
+        ({"train": {"steps": "10"}}, "must be int"),
+        ({"train": {"steps": 0}}, "between 1 and 100000"),
+        ({"train": {"lr": 1}}, "between"),
+        ({"save": {"push_to_hub": 1}}, "must be bool"),
+        ({"train": 5}, "must be a mapping"),
+        ({"sample": {"prompts": "photo"}}, "must be list"),
+        ({"name": "../escape"}, "'name'"),
+        ({"trigger_word": 3}, "'trigger_word'"),
+    ]
+    for overrides, message in refused:
+        try:
+            render_training_template("training_conservative", overrides)
+        except ValueError as e:
+            assert message in str(e), (overrides, str(e))
+        else:
+            raise AssertionError(f"accepted {overrides}")
+    try:
+        render_training_template("nope")
+    except ValueError as e:
+        assert "training_conservative" in str(e)
+    print(f"   ✅ Merged, template untouched, {len(refused)} bad overrides refused")
+    return True
+
+def test_volume_templates():
+    """{id}.yaml files are validated once, reloaded when changed and reported when broken."""
+    print("\n🧪 Testing templates on the volume...")
+    directory = tempfile.mkdtemp()
+    registry = TrainingTemplateRegistry(BUILTIN_TRAINING_TEMPLATES, directory)
+    quick = yaml.safe_load(yaml.dump(BUILTIN_TRAINING_TEMPLATES["training_conservative"]))
+    quick["config"]["process"][0]["train"]["steps"] = 300
+    with open(os.path.join(directory, "quick.yaml"), "w") as f:
+        yaml.dump(quick, f)
+    with open(os.path.join(directory, "broken.yaml"), "w") as f:
+        f.write("job: extension\nconfig: {name: x, process: []}\n")
+    with open(os.path.join(directory, "notes.txt"), "w") as f:
+        f.write("not a template")
+
+    original = handler.TRAINING_TEMPLATE_RESCAN_SECONDS
+    handler.TRAINING_TEMPLATE_RESCAN_SECONDS = 0
+    try:
+        assert registry.get("quick") == quick and registry.get("training_conservative")
+        described = registry.describe()
+        assert set(described["templates"]) == {"training_conservative", "quick"}
+        assert "broken" in described["errors"] and "process" in described["errors"]["broken"]
+
+        loaded = registry.get("quick")
+        assert registry.get("quick") is loaded  # Unchanged file: not parsed again
+
+        quick["config"]["process"][0]["train"]["steps"] = 400
+        with open(os.path.join(directory, "quick.yaml"), "w") as f:
+            yaml.dump(quick, f)
+        os.utime(os.path.join(directory, "quick.yaml"), ns=(1, 1))
+        assert registry.get("quick")["config"]["process"][0]["train"]["steps"] == 400
+
+        os.remove(os.path.join(directory, "quick.yaml"))
+        assert registry.get("quick") is None and registry.get("training_conservative")
+    finally:
+        handler.TRAINING_TEMPLATE_RESCAN_SECONDS = original
+    print("   ✅ Loaded, cached, reloaded on change, broken file reported")
+    return True
+
+def test_train_with_template():
+    """train_with_yaml accepts template + overrides; the run is the same as sending the YAML."""
+    print("\n🧪 Testing train_with_yaml with a template...")
+    dataset = make_dataset()
+    overrides = {"name": f"tpl_{uuid.uuid4().hex[:6]}", "train": {"steps": 120}}
+    with NoTraining() as runs:
+        result = handler.handler({"input": {"type": "train_with_yaml", "template": "training_conservative",
+                                            "overrides": overrides, "dataset_path": dataset}})
+        assert result["status"] == "success" and result["template"] == "training_conservative", result
+        with open(result["config_path"]) as f:
+            written = yaml.safe_load(f)
+        process = written["config"]["process"][0]
+        assert process["train"]["steps"] == 120 and process["datasets"][0]["folder_path"] == dataset
+        assert handler.get_process(result["process_id"])["template"] == "training_conservative"
+
+        # The same config as a full YAML is the same training
+        full_yaml = yaml.dump(render_training_template("training_conservative", overrides))
+        same = handler.handler({"input": {"type": "train_with_yaml", "yaml_config": full_yaml, "dataset_path": dataset}})
+        assert same["memoized"] == "in_flight" and same["process_id"] == result["process_id"], same
+        assert len(runs.launched) == 1
+
+        bad = handler.handler({"input": {"type": "train_with_yaml", "template": "training_conservative",
+                                         "overrides": {"train": {"steps": -1}}}})
+        both = handler.handler({"input": {"type": "train_with_yaml", "template": "training_conservative",
+                                          "yaml_config": full_yaml}})
+        assert bad["status"] == both["status"] == "error" and "train.steps" in bad["error"]
+
+        # A template that sets its own folder_path keeps it when no dataset_path is passed
+        own_dataset = make_dataset()
+        own = handler.handler({"input": {"type": "train_with_yaml", "template": "training_conservative",
+                                         "overrides": {"name": f"tpl_{uuid.uuid4().hex[:6]}",
+                                                       "datasets": {"folder_path": own_dataset}}}})
+        assert own["status"] == "success", own
+        with open(own["config_path"]) as f:
+            assert yaml.safe_load(f)["config"]["process"][0]["datasets"][0]["folder_path"] == own_dataset
+
+    listed = handler.handler({"input": {"type": "list_templates"}})
+    assert listed["status"] == "success" and "training_conservative" in listed["templates"]
+    print("   ✅ Template run queued, identical YAML attached to it")
+    return True
+
+def main():
+    """Run all local tests."""
+    print("🧪 RUNNING LOCAL TRAINING TEMPLATE TESTS")
+    print("=" * 80)
+
+    tests = [
+        test_render_with_overrides,
+        test_volume_templates,
+        test_train_with_template,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            print(f"   ❌ Assertion failed: {e}")
+            results[test.__name__] = False
+
+    # Summary
+    print("\n" + "=" * 80)
+    print("📊 LOCAL TEST SUMMARY")
+    print("=" * 80)
+
+    passed_tests = sum(1 for v in results.values() if v)
+    for test_name, passed in results.items():
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"   {test_name.upper().replace('_', ' ')}: {status}")
+
+    print(f"\n🎯 OVERALL: {passed_tests}/{len(results)} tests passed")
+    return passed_tests == len(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+⬇️ CHUNKED MODEL DOWNLOAD CLIENT
+Downloads large .safetensors files (download_model) and bulk exports (bulk_download)
+from the backend in offset/length chunks
+
+- Chunks are fetched in parallel and verified against their chunk_sha256
+- Progress is kept in <dest>.part.json so an interrupted download resumes
+- The finished file is checked against the whole-file sha256 (when the server has one) before it is renamed
+- A file changing on the server mid-download is detected by its version (or sha256 / export token)
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 3
+
+def response_version(response: Dict[str, Any]) -> Optional[str]:
+    """What identifies the file contents behind a chunk response (the sha256 may still be pending)."""
+    return response.get("version") or response.get("sha256") or response.get("token")
+
+class ChunkedDownloadError(Exception):
+    """Raised when a chunk keeps failing or the finished file does not match its hash."""
+
+class ChunkedModelDownloader:
+    """
+    request_fn(job_type, input_data) must return the handler output dict,
+    e.g. a wrapper around /runsync or handler.handler for local tests.
+    job_type is "download_model" (selector: model_path / filename / process_id)
+    or "bulk_download" (selector: {"token": ...} from a created export).
+    """
+
+    def __init__(self, request_fn: Callable[[str, Dict[str, Any]], Dict[str, Any]],
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = DEFAULT_WORKERS,
+                 max_retries: int = DEFAULT_RETRIES, retry_delay: float = 1.0,
+                 job_type: str = "download_model"):
+        self.request_fn = request_fn
+        self.job_type = job_type
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.lock = threading.Lock()
+
+    def request(self, selector: Dict[str, Any], offset: int, length: int) -> Dict[str, Any]:
+        result = self.request_fn(self.job_type, {**selector, "offset": offset, "length": length})
+        if result.get("status") != "success":
+            raise ChunkedDownloadError(result.get("error", f"{self.job_type} failed: {result}"))
+        return result
+
+    def load_state(self, state_path: str, size: int, version: str) -> set:
+        """Offsets already written for this exact file version (empty if anything changed)."""
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if (state.get("size_bytes"), state.get("version"), state.get("chunk_size")) != (size, version, self.chunk_size):
+            return set()
+        return set(state.get("done", []))
+
+    def save_state(self, state_path: str, size: int, version: str, done: set):
+        with open(state_path, "w") as f:
+            json.dump({"size_bytes": size, "version": version, "chunk_size": self.chunk_size,
+                       "done": sorted(done)}, f)
+
+    def fetch_chunk(self, selector: Dict[str, Any], offset: int, version: Optional[str]) -> bytes:
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                chunk = self.request(selector, offset, self.chunk_size)
+                if response_version(chunk) != version:
+                    raise ChunkedDownloadError("File changed on the server during download")
+                data = base64.b64decode(chunk["content"])
+                if hashlib.sha256(data).hexdigest() != chunk["chunk_sha256"]:
+                    raise ValueError(f"chunk at offset {offset} failed its sha256 check")
+                return data
+            except ChunkedDownloadError:
+                raise
+            except Exception as e:
+                last_error = e
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_delay * (2 ** attempt))
+        raise ChunkedDownloadError(f"Chunk at offset {offset} failed after {self.max_retries + 1} attempts: {last_error}")
+
+    def download(self, selector: Dict[str, Any], dest_path: str,
+                 progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+        """
+        Download the file described by selector to dest_path.
+        Returns size, sha256 and how many chunks were fetched vs. resumed.
+        """
+        info = self.request(selector, 0, 0)
+        size, version = info["size_bytes"], response_version(info)
+        part_path, state_path = dest_path + ".part", dest_path + ".part.json"
+
+        done = self.load_state(state_path, size, version) if os.path.exists(part_path) else set()
+        if not done:
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+        resumed = len(done)
+        pending = [offset for offset in range(0, size, self.chunk_size) if offset not in done]
+
+        with open(part_path, "r+b") as out, ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.fetch_chunk, selector, offset, version): offset for offset in pending}
+            try:
+                for future in as_completed(futures):
+                    offset = futures[future]
+                    data = future.result()
+                    with self.lock:
+                        out.seek(offset)
+                        out.write(data)
+                        out.flush()
+                        done.add(offset)
+                        self.save_state(state_path, size, version, done)
+                    if progress:
+                        progress(min(len(done) * self.chunk_size, size), size)
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        # The server hashes in the background; ask again now that the transfer took a while
+        sha256 = info.get("sha256")
+        if not sha256 and info.get("sha256_pending"):
+            latest = self.request(selector, 0, 0)
+            if response_version(latest) != version:
+                raise ChunkedDownloadError("File changed on the server during download")
+            sha256 = latest.get("sha256")
+        digest = hashlib.sha256()
+        with open(part_path, "rb") as f:
+            for block in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b""):
+                digest.update(block)
+        if sha256 and digest.hexdigest() != sha256:
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            raise ChunkedDownloadError("Downloaded file does not match the server sha256")
+
+        os.replace(part_path, dest_path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return {
+            "path": dest_path,
+            "filename": info["filename"],
+            "size_bytes": size,
+            "sha256": digest.hexdigest(),
+            "chunks_fetched": len(pending),
+            "chunks_resumed": resumed
+        }
@@ -33,6 +33,8 @@ except ImportError:
     print("Please ensure config_loader_shared.py is in the same directory.")
     sys.exit(1)
 
+from chunked_download_client import ChunkedModelDownloader
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -69,6 +71,7 @@ class TestConfig:
     RETRY_COUNT = 2
     LOG_FILE = "runpod_test_log_v2.txt"
     RESULTS_FILE = "test_results_v2.json"
+    DOWNLOAD_DIR = "downloaded_models"
     
     # 📁 TEST DATA - SMALLER PAYLOAD
     TEST_TRAINING_NAME = "test_lora_mini"
@@ -442,6 +445,33 @@ class RunPodBackendTesterV2:
             self.log_test_result("get_lora_models_fixed", False, error=str(e))
             return False
     
+    def test_chunked_model_download(self) -> bool:
+        """Download the newest trained model in verified chunks (skipped when there is none)"""
+        try:
+            result, duration = self.make_runpod_request("list_models", {"limit": 1})
+            models = result.get("output", result).get("models", [])
+            if not models:
+                self.log_test_result("chunked_model_download", True, {"skipped": "no trained models"}, duration=duration)
+                return True
+            
+            def request_fn(job_type, input_data):
+                response, _ = self.make_runpod_request(job_type, input_data)
+                return response.get("output", response)
+            
+            dest_path = os.path.join(self.config.DOWNLOAD_DIR, models[0]["filename"])
+            os.makedirs(self.config.DOWNLOAD_DIR, exist_ok=True)
+            start_time = time.time()
+            downloaded = ChunkedModelDownloader(request_fn).download({"model_path": models[0]["full_path"]}, dest_path)
+            duration = time.time() - start_time
+            
+            self.log_test_result("chunked_model_download", True, downloaded, duration=duration)
+            self.logger.info(f"⬇️ {downloaded['filename']}: {downloaded['size_bytes']} bytes, sha256 verified")
+            return True
+            
+        except Exception as e:
+            self.log_test_result("chunked_model_download", False, error=str(e))
+            return False
+    
     def test_start_generation_quick(self) -> Optional[str]:
         """Test starting a quick image generation"""
         try:
@@ -497,13 +527,13 @@ class RunPodBackendTesterV2:
             
             result, duration = self.make_runpod_request("bulk_download", download_request)
             
-            download_items = []
-            if "output" in result:
-                download_items = result["output"].get("download_items", [])
-            elif "download_items" in result:
-                download_items = result["download_items"]
-            
-            self.log_test_result("bulk_download_simple", True, {"download_count": len(download_items)}, duration=duration)
+            # bulk_download answers with a retrieval token; the tar is fetched in chunks (chunked_download_client)
+            output = result.get("output", result)
+            self.log_test_result("bulk_download_simple", True, {
+                "token": output.get("token"),
+                "total_files": output.get("total_files", 0),
+                "total_size": output.get("total_size", 0)
+            }, duration=duration)
             return True
             
         except Exception as e:
@@ -639,6 +669,9 @@ class RunPodBackendTesterV2:
         self.logger.info("⬇️ Testing Download URL...")
         test_results["download_url"] = self.test_download_url()
         
+        self.logger.info("⬇️ Testing Chunked Model Download...")
+        test_results["chunked_download"] = self.test_chunked_model_download()
+        
         self.logger.info("⬇️ Testing Bulk Download...")
         test_results["bulk_download"] = self.test_bulk_download_simple()
         